@@ -0,0 +1,278 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import field_backends
+from magnet_field import magnet_array, magnet_sources, array_field, GridInterpolator
+from carriage import carriage_force
+
+# Fixed benchmark scenarios for field evaluation, rendering and encoding.
+#
+#     python benchmark.py -o results.json
+#     python benchmark.py -o new.json --compare results.json
+#
+# Every scenario is a setup function that returns the callable to time, so
+# building inputs is never measured. Each callable is timed `repeat` times
+# and then run once more under tracemalloc for its peak Python/NumPy heap
+# usage. Inputs are seeded, so runs on the same machine are comparable.
+# Scenarios only time; the agreement of the backends and solvers is checked
+# by test_fields.py.
+
+scenarios = {}
+
+def scenario(name):
+    def register(setup):
+        scenarios[name] = setup
+        return setup
+    return register
+
+def _array(n_magnets):
+    return magnet_sources(magnet_array(n_magnets, 2, 0, 0.5, 0.2), 5)
+
+def _grid(sources, nx=550, ny=400):
+    x_max = np.abs(sources[:, 0]).max() + 3
+    return np.meshgrid(np.linspace(-x_max, x_max, nx), np.linspace(-4, 4, ny))
+
+for _n in (8, 64, 1024):
+    @scenario(f'field grid, {_n} magnets')
+    def _field_grid(n_magnets=_n):
+        sources = _array(n_magnets)
+        X, Y = _grid(sources)
+        return lambda: array_field(X, Y, sources)
+
+@scenario('field grid, 64 magnets, float32')
+def _field_grid_float32():
+    sources = _array(64)
+    X, Y = _grid(sources)
+    return lambda: array_field(X, Y, sources, dtype=np.float32)
+
+def _with_backend(backend, function, *args, **kwargs):
+    previous = field_backends.get_backend()
+    field_backends.set_backend(backend)
+    try:
+        return function(*args, **kwargs)
+    finally:
+        field_backends.set_backend(previous)
+
+for _backend in field_backends.available_backends():
+    for _n in (8, 64, 1024):
+        for _nx, _ny in ((275, 200), (550, 400)):
+            @scenario(f'field grid {_nx}x{_ny}, {_n} magnets, {_backend} backend')
+            def _field_grid_backend(backend=_backend, n_magnets=_n, nx=_nx, ny=_ny):
+                sources = _array(n_magnets)
+                X, Y = _grid(sources, nx, ny)
+                return lambda: _with_backend(backend, array_field, X, Y, sources)
+
+# A long stator: whole cells in closed form against summing every source
+@scenario('field grid, 1024 magnets, periodic solver')
+def _field_grid_periodic():
+    from periodic_field import periodic_array_field
+    sources = _array(1024)
+    X, Y = _grid(sources)
+    return lambda: periodic_array_field(X, Y, sources)
+
+# Many sources: the Barnes-Hut tree against summing every source
+@scenario('field grid, 4096 magnets, tree solver')
+def _field_grid_tree():
+    from tree_field import tree_field
+    sources = _array(4096)
+    X, Y = _grid(sources)
+    return lambda: tree_field(X, Y, sources)
+
+# Grid lookups cost the same for any number of sources, exact queries grow with it
+for _n in (8, 64):
+    @scenario(f'point queries, {_n} magnets, exact')
+    def _point_queries(n_magnets=_n):
+        sources = _array(n_magnets)
+        x_max = np.abs(sources[:, 0]).max() + 3
+        rng = np.random.default_rng(0)
+        px, py = rng.uniform(-x_max, x_max, 100000), rng.uniform(-4, 4, 100000)
+        return lambda: array_field(px, py, sources)
+
+    for _method in ('bilinear', 'bicubic'):
+        @scenario(f'point queries, {_n} magnets, {_method} grid')
+        def _grid_queries(n_magnets=_n, method=_method):
+            sources = _array(n_magnets)
+            X, Y = _grid(sources)
+            interpolator = GridInterpolator(X[0], Y[:, 0], *array_field(X, Y, sources), method=method)
+            x_max = np.abs(sources[:, 0]).max() + 3
+            rng = np.random.default_rng(0)
+            px, py = rng.uniform(-x_max, x_max, 100000), rng.uniform(-4, 4, 100000)
+            return lambda: interpolator(px, py)
+
+@scenario('winding field frame, precomputed basis')
+def _winding_field():
+    # Step 5's grid: PM field plus the energised winding, one frame
+    from carriage import phase_currents
+    from winding_field import WindingFieldBasis
+    sources = _array(8)
+    x, y = np.linspace(-11, 11, 440), np.linspace(-4, 4, 320)
+    X, Y = np.meshgrid(x, y)
+    Bx_pm, By_pm = array_field(X, Y, sources)
+    basis = WindingFieldBasis(x, y, Bx_pm, By_pm, (-4, 4))
+    currents = phase_currents(0.3, 10)
+    out = (np.empty_like(Bx_pm), np.empty_like(By_pm))
+    return lambda: basis.field(1.234, currents, out)
+
+@scenario('force sweep, 1000 positions x 360 angles')
+def _force_sweep():
+    sources = _array(8)
+    field = lambda x, y: array_field(x, y, sources)
+    positions = np.linspace(-4, 4, 1000)[:, None]
+    angles = np.linspace(0, 2 * np.pi, 360)[None, :]
+    return lambda: carriage_force(field, positions, angles, 10)
+
+@scenario('force sweep, axisymmetric rings, 1000 positions x 360 angles')
+def _ring_force_sweep():
+    from ring_field import RingField, magnet_rings
+    field = RingField(magnet_rings(magnet_array(8, 2, 0, 0.5, 0.2), 5, n_rings=3))
+    positions = np.linspace(-4, 4, 1000)[:, None]
+    angles = np.linspace(0, 2 * np.pi, 360)[None, :]
+    return lambda: carriage_force(field, positions, angles, 10)
+
+@scenario('tolerance analysis, 1000 perturbed arrays')
+def _tolerance():
+    from tolerance import tolerance_analysis
+    return lambda: tolerance_analysis(n_samples=1000, seed=0)
+
+def _background_field():
+    sources = _array(8)
+    X, Y = _grid(sources)
+    Bx, By = array_field(X, Y, sources)
+    return X, Y, Bx, By
+
+@scenario('background, traced streamlines')
+def _traced_streamlines():
+    from streamlines import trace_streamlines
+    X, Y, Bx, By = _background_field()
+    return lambda: trace_streamlines(X[0], Y[:, 0], Bx, By, density=2.5)
+
+@scenario('background, matplotlib streamplot')
+def _streamplot():
+    from matplotlib.figure import Figure
+    X, Y, Bx, By = _background_field()
+    color = np.log(np.hypot(Bx, By))
+
+    def run():
+        ax = Figure(figsize=(12, 6)).subplots()
+        ax.streamplot(X, Y, Bx, By, color=color, cmap='viridis', density=2.5, linewidth=2, arrowsize=1.5)
+    return run
+
+def _scene(dpi=150):
+    # A step 3 style scene: static background image and magnets, moving wire and force arrow
+    import matplotlib.patches as patches
+    from matplotlib.figure import Figure
+    from frame_render import BlitRenderer
+
+    magnets = magnet_array(8, 2, 0, 0.5, 0.2)
+    background = np.random.default_rng(0).integers(0, 255, (400, 800, 3), dtype=np.uint8)
+    fig = Figure(figsize=(12, 6), dpi=dpi)
+    ax = fig.subplots()
+    ax.imshow(background, extent=(-11, 11, -4, 4), aspect='auto', zorder=0)
+    for (start_x, start_y, width, height, north_x, north_y, south_x, south_y) in magnets:
+        ax.add_patch(patches.Rectangle((start_x, -height/2), width, height, linewidth=1, edgecolor='black', facecolor='grey', zorder=2))
+        ax.scatter([north_x, south_x], [north_y, south_y], c=['red', 'blue'], s=75, zorder=3)
+    wire = ax.scatter([0], [1], c='orange', s=150, zorder=4)
+    force = ax.quiver(0, 1, 0, 0, color='black', scale=50, scale_units='xy', angles='xy', width=0.005, zorder=5)
+    ax.set_xlim(-11, 11)
+    ax.set_ylim(-4, 4)
+    renderer = BlitRenderer(fig, [wire, force])
+
+    def draw(i):
+        wire.set_offsets([[-10 + i / 2, 1]])
+        force.set_offsets([[-10 + i / 2, 1]])
+        force.set_UVC(5 * np.sin(i / 5), 5 * np.cos(i / 5))
+        return renderer.render()
+    return draw
+
+@scenario('per-frame render, 150 dpi')
+def _frame_render():
+    draw = _scene()
+    frames = iter(range(10**9))
+    return lambda: draw(next(frames) % 40)
+
+@scenario('GIF encode, 40 frames at 150 dpi')
+def _gif_encode():
+    from frame_writer import open_writer
+    draw = _scene()
+    frames = [draw(i) for i in range(40)]
+
+    def run():
+        with tempfile.TemporaryDirectory() as directory:
+            with open_writer(os.path.join(directory, 'benchmark.gif'), duration=25, palette_frames=frames[::10]) as writer:
+                for frame in frames:
+                    writer.write(frame)
+    return run
+
+def run_benchmarks(names, repeat=5):
+    """Time the named scenarios; returns {name: {'best', 'median', 'peak_bytes', 'repeat'}}."""
+    results = {}
+    for name in names:
+        run = scenarios[name]()
+        run()  # warm-up: imports, caches and first-touch page faults
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results[name] = {'best': min(times), 'median': statistics.median(times), 'peak_bytes': peak, 'repeat': repeat}
+        print(f"{name:60s} {min(times) * 1e3:10.1f} ms {peak / 2**20:10.1f} MiB")
+    return results
+
+def compare(results, baseline, tolerance=0.1):
+    """Print the change against `baseline` per scenario; returns the names that got slower than 1 + tolerance."""
+    regressions = []
+    print(f"\n{'scenario':60s} {'baseline':>10s} {'now':>10s} {'ratio':>7s} {'peak':>7s}")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:60s} {'-':>10s} {result['best'] * 1e3:8.1f}ms")
+            continue
+        old = baseline[name]
+        ratio = result['best'] / old['best']
+        memory = result['peak_bytes'] / max(old['peak_bytes'], 1)
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  SLOWER'
+            regressions.append(name)
+        print(f"{name:60s} {old['best'] * 1e3:8.1f}ms {result['best'] * 1e3:8.1f}ms {ratio:7.2f} {memory:7.2f}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the fixed benchmark scenarios.')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('-k', '--filter', default='', help='only run scenarios whose name contains this text')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='timed runs per scenario (default 5)')
+    parser.add_argument('--compare', metavar='BASELINE', help='compare against a results file written earlier')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown before a scenario counts as a regression (default 0.1)')
+    args = parser.parse_args(argv)
+
+    names = [name for name in scenarios if args.filter in name]
+    results = run_benchmarks(names, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'machine': {'python': sys.version.split()[0], 'numpy': np.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count()},
+                'results': results,
+            }, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
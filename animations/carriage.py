@@ -0,0 +1,185 @@
+import numpy as np
+
+# Thrust and back-EMF of the moving carriage.
+#
+# A winding is a list of (offset, y, phase, sign) wires: `offset` is the wire
+# position relative to the carriage centre, `phase` indexes the phase that
+# feeds it and `sign` (+1 or -1) its direction. Phase k carries
+# amplitude * sin(angle + phase_shifts[k]), and the Lorentz force on a wire
+# carrying I into the plane is (I L By, -I L Bx).
+#
+# `field` arguments are callables field(x, y) -> (Bx, By), for example
+# functools.partial(array_field, sources=sources).
+
+phase_shifts = (-np.pi/3, 0, np.pi/3)
+
+# The carriage of step 5: A, B, C and their opposites at y = 1, each with a
+# return wire carrying the opposite current at y = -1
+step5_winding = [
+    (-1.666667, 1, 0, 1),
+    (-1.000000, 1, 1, 1),
+    (-0.333333, 1, 2, 1),
+    (0.333333, 1, 0, -1),
+    (1.000000, 1, 1, -1),
+    (1.666667, 1, 2, -1),
+    (-1.666667, -1, 0, -1),
+    (-1.000000, -1, 1, -1),
+    (-0.333333, -1, 2, -1),
+    (0.333333, -1, 0, 1),
+    (1.000000, -1, 1, 1),
+    (1.666667, -1, 2, 1),
+]
+
+def make_winding(pitch=2/3, y=1.0):
+    """A step 5 style winding with `pitch` between neighbouring wires and its wires at +-y."""
+    winding = []
+    for side in (1, -1):
+        for i, offset in enumerate(pitch * np.arange(-2.5, 3)):
+            winding.append((offset, side * y, i % 3, side * (1 if i < 3 else -1)))
+    return winding
+
+def winding_arrays(winding):
+    """Offsets, heights, phase indices and signs of `winding` as arrays."""
+    offsets, ys, phases, signs = (np.array(column) for column in zip(*winding))
+    return offsets.astype(float), ys.astype(float), phases.astype(np.intp), signs.astype(float)
+
+def phase_currents(angles, amplitudes):
+    """Current in every phase, with the phase along the last axis."""
+    angles = np.asarray(angles, dtype=float)[..., None]
+    return np.asarray(amplitudes, dtype=float)[..., None] * np.sin(angles + np.array(phase_shifts))
+
+def wire_forces(field, position, angle, amplitude, winding=step5_winding, L=1.0):
+    """Position, current and force of every wire for one carriage operating point.
+
+    Returns (wire_x, wire_y, currents, Fx, Fy), one entry per wire in `winding`.
+    """
+    offsets, ys, phases, signs = winding_arrays(winding)
+    wire_x = position + offsets
+    currents = signs * phase_currents(angle, amplitude)[phases]
+    Bx, By = field(wire_x, ys)
+    return wire_x, ys, currents, currents * L * By, -currents * L * Bx
+
+def force_basis(field, positions, winding=step5_winding, L=1.0, chunk_size=2**16):
+    """Force per ampere of each phase at each carriage position.
+
+    Returns (Gx, Gy) of shape (n_phases,) + positions.shape, so that the
+    thrust for phase currents I_k is sum_k I_k * G_k. A field that returns
+    leading sample axes (magnet_field.batched_array_field) keeps them in
+    front of the phase axis.
+    """
+    positions = np.asarray(positions, dtype=float)
+    offsets, ys, phases, signs = winding_arrays(winding)
+    n_phases = len(phase_shifts)
+    flat = positions.ravel()
+
+    # Signed sum of the wires of each phase as one matrix product
+    phase_matrix = np.zeros((len(winding), n_phases))
+    phase_matrix[np.arange(len(winding)), phases] = signs * L
+
+    Gx, Gy = [], []
+    for lo in range(0, len(flat), chunk_size):
+        wire_x = flat[lo:lo + chunk_size, None] + offsets
+        Bx, By = field(wire_x, np.broadcast_to(ys, wire_x.shape))
+        Gx.append(np.swapaxes(By @ phase_matrix, -1, -2))
+        Gy.append(-np.swapaxes(Bx @ phase_matrix, -1, -2))
+    if not Gx:
+        return np.zeros((n_phases,) + positions.shape), np.zeros((n_phases,) + positions.shape)
+    Gx = np.concatenate(Gx, axis=-1)
+    Gy = np.concatenate(Gy, axis=-1)
+    return Gx.reshape(Gx.shape[:-1] + positions.shape), Gy.reshape(Gy.shape[:-1] + positions.shape)
+
+def carriage_force(field, positions, angles, amplitudes, winding=step5_winding, L=1.0, basis=None):
+    """Total carriage force (Fx, Fy) at every combination of position, electrical angle and amplitude.
+
+    The three inputs broadcast against each other (e.g. positions[:, None]
+    against angles[None, :]). The field is only evaluated at the positions;
+    pass a precomputed force_basis(field, positions, ...) as `basis` to skip
+    even that.
+    """
+    positions = np.asarray(positions, dtype=float)
+    Gx, Gy = basis if basis is not None else force_basis(field, positions, winding, L)
+    currents = phase_currents(angles, amplitudes)
+
+    Fx = 0
+    Fy = 0
+    for k in range(len(phase_shifts)):
+        Fx = Fx + currents[..., k] * Gx[k]
+        Fy = Fy + currents[..., k] * Gy[k]
+    return Fx, Fy
+
+def thrust_metrics(field, positions, period, amplitude=1.0, winding=step5_winding, L=1.0, basis=None):
+    """Force constant, commutation angle and thrust ripple over `positions`.
+
+    The carriage is commutated as angle = 2 pi position / period + delta.
+    The commutation angle is the delta that maximises the mean thrust; the
+    force constant is that mean thrust per ampere of amplitude and the
+    ripple the peak-to-peak thrust at that angle relative to its mean. The
+    planar model has no iron, so there is no cogging term to correct for.
+
+    Returns a dict with 'force_constant', 'commutation_angle',
+    'thrust_ripple' and the thrust at every position as 'thrust'. A
+    precomputed force_basis may be passed as `basis`; if it has leading
+    sample axes, so do the metrics, each sample with its own angle.
+    """
+    positions = np.asarray(positions, dtype=float)
+    Gx, _ = basis if basis is not None else force_basis(field, positions, winding, L)
+
+    # Fx(delta) = amplitude * (cos(delta) * S + sin(delta) * C)
+    electrical = 2 * np.pi * positions / period + np.array(phase_shifts)[:, None]
+    S = np.sum(np.sin(electrical) * Gx, axis=-2)
+    C = np.sum(np.cos(electrical) * Gx, axis=-2)
+    delta = np.arctan2(C.mean(axis=-1), S.mean(axis=-1))
+    thrust = amplitude * (np.cos(delta)[..., None] * S + np.sin(delta)[..., None] * C)
+
+    return {
+        'force_constant': np.hypot(S.mean(axis=-1), C.mean(axis=-1)),
+        'commutation_angle': delta,
+        'thrust_ripple': np.ptp(thrust, axis=-1) / thrust.mean(axis=-1),
+        'thrust': thrust,
+    }
+
+def emf_harmonics(emf, n_periods=1, max_order=15):
+    """Fundamental amplitude and distortion of EMF waveforms sampled over `n_periods` whole periods.
+
+    `emf` has the samples along its last axis. Returns a dict with the
+    amplitude of the fundamental as 'emf_constant', the total harmonic
+    distortion of harmonics 2 to `max_order` as 'emf_thd' and the 3rd and
+    5th harmonics relative to the fundamental as 'emf_h3' and 'emf_h5'.
+    """
+    emf = np.asarray(emf, dtype=float)
+    spectrum = np.abs(np.fft.rfft(emf, axis=-1)) * 2 / emf.shape[-1]
+    # Harmonic k of the waveform is bin k * n_periods; harmonic order leads from here on
+    harmonics = np.moveaxis(spectrum, -1, 0)[n_periods * np.arange(max_order + 1)]
+    fundamental = harmonics[1]
+    return {
+        'emf_constant': fundamental,
+        'emf_thd': np.sqrt(np.sum(harmonics[2:]**2, axis=0)) / fundamental,
+        'emf_h3': harmonics[3] / fundamental,
+        'emf_h5': harmonics[5] / fundamental,
+    }
+
+def stream_back_emf(field, positions, velocities, winding=step5_winding, L=1.0, turns=1, chunk_size=2**16):
+    """Yield (start, emf) for consecutive chunks of a trajectory.
+
+    `emf` has shape (n_phases, chunk) and covers positions[start:start + chunk].
+    Only one chunk is in memory at a time, so `positions` and `velocities`
+    may be memory-mapped arrays far larger than RAM.
+    """
+    for start in range(0, len(positions), chunk_size):
+        stop = start + chunk_size
+        chunk = np.asarray(positions[start:stop], dtype=float)
+        velocity = np.broadcast_to(np.asarray(velocities, dtype=float), (len(positions),))[start:stop]
+        # EMF of a wire moving through By is v By L, i.e. velocity times the force per ampere
+        Gx, _ = force_basis(field, chunk, winding, L, chunk_size)
+        yield start, turns * velocity * Gx
+
+def back_emf(field, positions, velocities, winding=step5_winding, L=1.0, turns=1, chunk_size=2**16):
+    """Back-EMF of every phase along a carriage trajectory, shape (n_phases, len(positions)).
+
+    `velocities` is the carriage velocity at each position (or one value for
+    all of them) and `turns` the number of turns per wire.
+    """
+    emf = np.empty((len(phase_shifts), len(positions)))
+    for start, chunk in stream_back_emf(field, positions, velocities, winding, L, turns, chunk_size):
+        emf[:, start:start + chunk.shape[1]] = chunk
+    return emf
@@ -0,0 +1,137 @@
+import importlib.util
+import os
+import numpy as np
+
+# Imported by their loaders the first time their backend is selected, so
+# that importing magnet_field stays cheap with the default backend
+numexpr = None
+numba = None
+
+# Compute backends for the monopole superposition behind magnet_field.array_field.
+#
+# Every kernel adds the field of the sources (sx, sy, q) at the targets
+# (x, y), two broadcast arrays of the same shape, to the flat output arrays
+# Bx and By. 'numpy' (the default) works in chunks of at most chunk_size
+# target/source pairs; 'numexpr' uses the same chunks but computes their
+# weights q / r^2 in one fused, multi-threaded expression; 'numba' compiles
+# a parallel loop over the targets with the sources in the inner loop, so
+# no temporaries are made at all. The optional backends are only available
+# when their package is installed. The backend is chosen with set_backend
+# or the TLM_FIELD_BACKEND environment variable ('auto' picks the fastest
+# one installed).
+
+# Targets per block for the numba kernel
+block_size = 2**20
+
+def _numpy_kernel(x, y, sx, sy, q, Bx, By, chunk_size):
+    n = Bx.size
+    step = min(max(1, chunk_size // max(1, len(sx))), max(n, 1))
+    dx, dy, weight, square = (np.empty((step, len(sx)), Bx.dtype) for _ in range(4))
+    total = np.empty(step, Bx.dtype)
+
+    for lo in range(0, n, step):
+        m = min(step, n - lo)
+        a, b, w, t, s = dx[:m], dy[:m], weight[:m], square[:m], total[:m]
+        np.subtract(x.flat[lo:lo + m][:, None], sx, out=a)
+        np.subtract(y.flat[lo:lo + m][:, None], sy, out=b)
+        np.multiply(a, a, out=w)
+        w += np.multiply(b, b, out=t)
+        np.copyto(w, 1e-12, where=w == 0)
+        np.divide(q, w, out=w)
+        Bx[lo:lo + m] += np.einsum('ij,ij->i', a, w, out=s)
+        By[lo:lo + m] += np.einsum('ij,ij->i', b, w, out=s)
+
+def _numexpr_kernel(x, y, sx, sy, q, Bx, By, chunk_size):
+    # The numpy kernel with the weights of a chunk computed in one fused, multi-threaded pass
+    n = Bx.size
+    step = min(max(1, chunk_size // max(1, len(sx))), max(n, 1))
+    dx, dy, weight = (np.empty((step, len(sx)), Bx.dtype) for _ in range(3))
+    total = np.empty(step, Bx.dtype)
+    names = {'q': q}
+    # Targets that sit on a source get no contribution from it, as with the
+    # other kernels; they are rare, so the candidates are found once and
+    # patched up instead of testing every pair in the expression
+    on_source = np.isin(x, sx).ravel()
+    on_source[on_source] = np.isin(y.ravel()[on_source], sy)
+
+    for lo in range(0, n, step):
+        m = min(step, n - lo)
+        a, b, w, s = dx[:m], dy[:m], weight[:m], total[:m]
+        np.subtract(x.flat[lo:lo + m][:, None], sx, out=a)
+        np.subtract(y.flat[lo:lo + m][:, None], sy, out=b)
+        names['a'], names['b'] = a, b
+        numexpr.evaluate('q / (a*a + b*b)', local_dict=names, out=w)
+        rows = np.flatnonzero(on_source[lo:lo + m])
+        if len(rows):
+            w[rows] = np.where((a[rows] == 0) & (b[rows] == 0), 0, w[rows])
+        Bx[lo:lo + m] += np.einsum('ij,ij->i', a, w, out=s)
+        By[lo:lo + m] += np.einsum('ij,ij->i', b, w, out=s)
+
+def _load_numexpr():
+    global numexpr
+    import numexpr
+    return _numexpr_kernel
+
+_numba_loop = None
+
+def _load_numba():
+    global numba, _numba_loop
+    import numba
+
+    @numba.njit(parallel=True, cache=True)
+    def loop(tx, ty, sx, sy, q, Bx, By):
+        for i in numba.prange(tx.shape[0]):
+            bx = 0.0
+            by = 0.0
+            for j in range(sx.shape[0]):
+                dx = tx[i] - sx[j]
+                dy = ty[i] - sy[j]
+                r_squared = dx * dx + dy * dy
+                if r_squared == 0:
+                    r_squared = 1e-12
+                w = q[j] / r_squared
+                bx += dx * w
+                by += dy * w
+            Bx[i] += bx
+            By[i] += by
+
+    _numba_loop = loop
+    return _numba_kernel
+
+def _numba_kernel(x, y, sx, sy, q, Bx, By, chunk_size):
+    for lo in range(0, Bx.size, block_size):
+        tx = np.ascontiguousarray(x.flat[lo:lo + block_size])
+        ty = np.ascontiguousarray(y.flat[lo:lo + block_size])
+        _numba_loop(tx, ty, sx, sy, q, Bx[lo:lo + block_size], By[lo:lo + block_size])
+
+# Kernels of the backends loaded so far, and the loaders of the optional ones
+backends = {'numpy': _numpy_kernel}
+_loaders = {'numexpr': _load_numexpr, 'numba': _load_numba}
+
+_current = 'numpy'
+
+def available_backends():
+    """Names of the backends that can be selected, i.e. whose package is installed."""
+    return ['numpy'] + [name for name in _loaders if importlib.util.find_spec(name) is not None]
+
+def set_backend(name):
+    """Use backend `name` ('numpy', 'numexpr', 'numba' or 'auto') for all field evaluations."""
+    global _current
+    if name == 'auto':
+        available = available_backends()
+        name = next(backend for backend in ('numba', 'numexpr', 'numpy') if backend in available)
+    if name not in backends:
+        if name not in available_backends():
+            raise ValueError(f"field backend {name!r} is not available; installed: {', '.join(available_backends())}")
+        backends[name] = _loaders[name]()
+    _current = name
+
+def get_backend():
+    """Name of the backend in use."""
+    return _current
+
+def field_kernel():
+    """The kernel of the backend in use."""
+    return backends[_current]
+
+set_backend(os.environ.get('TLM_FIELD_BACKEND', 'numpy'))
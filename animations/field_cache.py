@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+
+# Content-addressed cache for field grids and rendered field backgrounds.
+#
+# Every entry is a directory named after the hash of the parameters that
+# produced it, holding .npy arrays (loaded memory-mapped) and rendered
+# files. Entries are touched when used and the least recently used ones
+# are removed once the cache grows past its size limit.
+
+default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'tubular-linear-motor')
+
+# Part of the key of every rendered entry; bump it whenever a change to the
+# drawing code changes what the cached images look like
+render_version = 1
+
+class FieldCache:
+    def __init__(self, directory=None, max_bytes=2**30):
+        if directory is None:
+            directory = os.environ.get('TLM_CACHE_DIR', default_cache_dir)
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, **params):
+        """Hash of `params` (geometry, grid and render settings) naming a cache entry."""
+        text = json.dumps(params, sort_keys=True, default=lambda value: np.asarray(value).tolist())
+        return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+    def render_key(self, **params):
+        """Like key(), for rendered entries: also changes with render_version and the matplotlib version."""
+        import matplotlib
+        return self.key(render_version=render_version, matplotlib=matplotlib.__version__, **params)
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key)
+
+    def _touch(self, key):
+        try:
+            os.utime(self._entry(key))
+        except FileNotFoundError:
+            pass
+
+    def arrays(self, key, names, compute):
+        """Arrays `names` of entry `key`, computing and storing them on a miss.
+
+        `compute()` returns the arrays in the order of `names`. Hits are
+        returned as read-only memory-mapped arrays.
+        """
+        entry = self._entry(key)
+        paths = [os.path.join(entry, name + '.npy') for name in names]
+        if all(os.path.exists(path) for path in paths):
+            self._touch(key)
+            return tuple(np.load(path, mmap_mode='r') for path in paths)
+
+        arrays = tuple(compute())
+        os.makedirs(entry, exist_ok=True)
+        for path, array in zip(paths, arrays):
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+        self._evict(keep=key)
+        return arrays
+
+    def file(self, key, name, write):
+        """Path of file `name` in entry `key`, creating it with `write(path)` on a miss."""
+        entry = self._entry(key)
+        path = os.path.join(entry, name)
+        if os.path.exists(path):
+            self._touch(key)
+            return path
+
+        os.makedirs(entry, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        write(tmp_path)
+        os.replace(tmp_path, path)
+        self._evict(keep=key)
+        return path
+
+    def _evict(self, keep):
+        # Other processes may add or evict entries meanwhile, so files can vanish under us
+        entries = []
+        total = 0
+        for key in os.listdir(self.directory):
+            entry = self._entry(key)
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, key))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            total += size
+
+        # Oldest first, never the entry that was just written
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key != keep:
+                shutil.rmtree(self._entry(key), ignore_errors=True)
+                total -= size
@@ -0,0 +1,90 @@
+import json
+import numpy as np
+from carriage import force_basis, phase_currents, phase_shifts, step5_winding
+from magnet_field import _catmull_rom_weights
+
+# Force lookup table for control simulation.
+#
+# Thrust is linear in the phase currents, so F(position, IA, IB, IC) is fully
+# described by the force per ampere of each phase as a function of position.
+# That basis is tabulated once on a dense, evenly spaced position grid and
+# stored as a memory-mapped .npy file of shape (n_positions, n_phases, 2)
+# with a .json file of metadata next to it. Queries interpolate the table and
+# never touch the field model.
+
+def build_force_table(path, field, positions, winding=step5_winding, L=1.0, chunk_size=2**16, **metadata):
+    """Tabulate the force basis of `winding` at the evenly spaced `positions` and save it to `path`.
+
+    Writes `path` + '.npy' and `path` + '.json'; extra keyword arguments are
+    stored in the metadata (e.g. the magnet parameters the field came from).
+    Returns the opened ForceTable.
+    """
+    positions = np.asarray(positions, dtype=float)
+    n_phases = len(phase_shifts)
+    table = np.lib.format.open_memmap(path + '.npy', mode='w+', shape=(len(positions), n_phases, 2))
+    for lo in range(0, len(positions), chunk_size):
+        Gx, Gy = force_basis(field, positions[lo:lo + chunk_size], winding, L)
+        table[lo:lo + chunk_size, :, 0] = Gx.T
+        table[lo:lo + chunk_size, :, 1] = Gy.T
+    table.flush()
+    del table
+
+    metadata.update(
+        start=positions[0],
+        step=(positions[-1] - positions[0]) / (len(positions) - 1),
+        count=len(positions),
+        phase_shifts=list(phase_shifts),
+        winding=[list(wire) for wire in winding],
+        L=L,
+    )
+    with open(path + '.json', 'w') as f:
+        json.dump(metadata, f, indent=2, default=float)
+    return ForceTable(path)
+
+class ForceTable:
+    """Memory-mapped force table written by build_force_table, with vectorized interpolated queries.
+
+    `method` is 'linear' or 'cubic' (Catmull-Rom). Positions outside the
+    table are clamped to its ends.
+    """
+
+    def __init__(self, path, method='linear'):
+        if method not in ('linear', 'cubic'):
+            raise ValueError(f"unknown interpolation method {method!r}")
+        with open(path + '.json') as f:
+            self.metadata = json.load(f)
+        self.table = np.load(path + '.npy', mmap_mode='r')
+        self.start = self.metadata['start']
+        self.step = self.metadata['step']
+        self.count = self.metadata['count']
+        self.method = method
+
+    def basis(self, positions):
+        """Force per ampere of each phase, shape positions.shape + (n_phases, 2) for (Fx, Fy)."""
+        f = np.clip((np.asarray(positions, dtype=float) - self.start) / self.step, 0, self.count - 1)
+        i = np.minimum(f.astype(np.intp), self.count - 2)
+        t = (f - i)[..., None, None]
+        if self.method == 'linear':
+            return (1 - t) * self.table[i] + t * self.table[i + 1]
+
+        # Past the ends of the table the outer neighbours are extrapolated linearly
+        table = self.table
+        p0, p1, p2 = table[i], table[i + 1], table[np.minimum(i + 2, self.count - 1)]
+        pm = np.where((i == 0)[..., None, None], 2 * p0 - p1, table[np.maximum(i - 1, 0)])
+        p2 = np.where((i == self.count - 2)[..., None, None], 2 * p1 - p0, p2)
+        wm, w0, w1, w2 = _catmull_rom_weights(t)
+        return wm * pm + w0 * p0 + w1 * p1 + w2 * p2
+
+    def force(self, positions, IA, IB, IC):
+        """Carriage force (Fx, Fy) for phase currents IA, IB, IC; all inputs broadcast together."""
+        positions, IA, IB, IC = np.broadcast_arrays(positions, IA, IB, IC)
+        currents = np.stack([IA, IB, IC], axis=-1)[..., None]
+        F = np.sum(self.basis(positions) * currents, axis=-2)
+        return F[..., 0], F[..., 1]
+
+    def force_from_angle(self, positions, angles, amplitudes):
+        """Carriage force (Fx, Fy) for an electrical angle and current amplitude, as in carriage_force."""
+        positions, angles, amplitudes = np.broadcast_arrays(positions, angles, amplitudes)
+        currents = phase_currents(angles, amplitudes)[..., None]
+        F = np.sum(self.basis(positions) * currents, axis=-2)
+        return F[..., 0], F[..., 1]
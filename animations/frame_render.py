@@ -0,0 +1,72 @@
+import collections
+import multiprocessing
+import os
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# The frame function of the render in progress. Pool workers are forked after
+# it is set, so they inherit it (and the background image and field arrays it
+# closes over) from the parent without pickling or copying anything.
+_draw_frame = None
+
+def _render(i):
+    return _draw_frame(i)
+
+def render_frames(draw_frame, n_frames, workers=None):
+    """Yield draw_frame(i) for every i in range(n_frames), in frame order.
+
+    Frames are rendered across `workers` processes (all cores when None) and
+    reassembled in order as they finish. At most two frames per worker are in
+    flight at once, so a slow consumer such as a frame writer keeps memory
+    bounded. With workers=1, or on platforms that cannot fork, frames are
+    rendered one after another in this process.
+    """
+    global _draw_frame
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, n_frames)
+
+    if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        for i in range(n_frames):
+            yield draw_frame(i)
+        return
+
+    _draw_frame = draw_frame
+    try:
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            pending = collections.deque()
+            next_frame = 0
+            while pending or next_frame < n_frames:
+                while next_frame < n_frames and len(pending) < 2 * workers:
+                    pending.append(pool.apply_async(_render, (next_frame,)))
+                    next_frame += 1
+                yield pending.popleft().get()
+    finally:
+        _draw_frame = None
+
+class BlitRenderer:
+    """Render frames of a persistent figure by redrawing only its moving artists.
+
+    The figure is drawn once without `animated` artists and the result is kept
+    as the background. Each call to render() restores that background, draws
+    the animated artists (in zorder) on top and returns a copy of the Agg
+    pixel buffer as an (height, width, 4) uint8 RGBA array.
+    """
+
+    def __init__(self, fig, animated):
+        if not isinstance(fig.canvas, FigureCanvasAgg):
+            FigureCanvasAgg(fig)
+        self.fig = fig
+        self.animated = sorted(animated, key=lambda artist: artist.get_zorder())
+        for artist in self.animated:
+            artist.set_animated(True)
+        fig.canvas.draw()
+        self.background = fig.canvas.copy_from_bbox(fig.bbox)
+
+    def render(self):
+        canvas = self.fig.canvas
+        canvas.restore_region(self.background)
+        for artist in self.animated:
+            self.fig.draw_artist(artist)
+        return np.array(canvas.buffer_rgba())
@@ -0,0 +1,181 @@
+import json
+import mmap
+import os
+import socket
+import numpy as np
+from frame_render import render_frames
+from frame_writer import open_writer
+from instrumentation import Profiler
+
+# Checkpointed renders.
+#
+# A FrameStore is a directory holding every frame of one animation in a
+# single memory-mapped file, frames.raw, next to a manifest.json that
+# describes it (frame count, frame shape and the key of the render
+# settings). Each frame starts on a page boundary, so processes on
+# different machines sharing the directory can fill disjoint frames without
+# touching each other's pages. A frame counts as finished once its index is
+# appended to the journal of the process that wrote it (done-<host>-<pid>),
+# after its pixels are flushed; a crash loses at most the frames in flight,
+# and a rerun renders only the frames no journal lists.
+
+class StoreMismatch(ValueError):
+    """A store directory holds the frames of a different render."""
+
+def read_manifest(directory):
+    """The manifest of the store in `directory` (n_frames, shape, key), None if it has none yet."""
+    try:
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _stride(frame_bytes):
+    page = mmap.ALLOCATIONGRANULARITY
+    return -(-frame_bytes // page) * page
+
+class FrameStore:
+    def __init__(self, directory, n_frames, key=None):
+        self.directory = directory
+        self.n_frames = n_frames
+        self.key = key
+        self.shape = None
+        self._frames = None
+        self._journal = None
+
+        manifest = read_manifest(directory)
+        if manifest is not None:
+            if manifest['n_frames'] != n_frames:
+                raise StoreMismatch(f"{directory} holds a render of {manifest['n_frames']} frames, not {n_frames}; "
+                                    "remove it or choose another directory")
+            if manifest['key'] != key:
+                raise StoreMismatch(f"{directory} holds the frames of a render with other settings; remove it or choose another directory")
+            self.shape = tuple(manifest['shape'])
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _create(self, shape):
+        os.makedirs(self.directory, exist_ok=True)
+        size = self.n_frames * _stride(int(np.prod(shape)))
+        with open(self._path('frames.raw'), 'ab') as f:
+            if f.tell() < size:
+                f.truncate(size)
+        tmp_path = self._path(f'manifest.json.{socket.gethostname()}.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'n_frames': self.n_frames, 'shape': list(shape), 'key': self.key}, f)
+        os.replace(tmp_path, self._path('manifest.json'))
+        self.shape = tuple(shape)
+
+    def _map(self, mode):
+        if self._frames is None or (mode == 'r+' and self._frames.mode != 'r+'):
+            frame_bytes = int(np.prod(self.shape))
+            self._frames = np.memmap(self._path('frames.raw'), np.uint8, mode, shape=(self.n_frames, _stride(frame_bytes)))
+        return self._frames
+
+    def done(self):
+        """Indices of the finished frames, from the journals of every process that wrote to the store."""
+        done = set()
+        if not os.path.isdir(self.directory):
+            return done
+        for name in os.listdir(self.directory):
+            if name.startswith('done-'):
+                with open(self._path(name)) as f:
+                    # A line cut short by a crash is ignored; that frame is rendered again
+                    done.update(int(line) for line in f if line.endswith('\n'))
+        return done
+
+    def missing(self, start=0, stop=None):
+        """Sorted indices in range(start, stop) of the frames still to render."""
+        done = self.done()
+        return [i for i in range(start, self.n_frames if stop is None else stop) if i not in done]
+
+    def complete(self):
+        return not self.missing()
+
+    def write(self, i, frame):
+        """Store frame `i`, an (height, width, channels) uint8 array, and mark it finished."""
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        if self.shape is None:
+            self._create(frame.shape)
+        elif frame.shape != self.shape:
+            raise StoreMismatch(f"frame of shape {frame.shape} does not fit a store of {self.shape} frames in {self.directory}")
+        frames = self._map('r+')
+        frames[i, :frame.size] = frame.reshape(-1)
+        frames.flush()
+
+        if self._journal is None:
+            self._journal = open(self._path(f'done-{socket.gethostname()}-{os.getpid()}'), 'a')
+        self._journal.write(f'{i}\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def __getitem__(self, i):
+        if self.shape is None:
+            raise IndexError(f"frame {i} has not been rendered")
+        return np.array(self._map('r')[i, :int(np.prod(self.shape))]).reshape(self.shape)
+
+    def frames(self):
+        """Yield every frame in order, reading one at a time from the store."""
+        for i in range(self.n_frames):
+            yield self[i]
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        self._frames = None
+
+def render_to_store(draw_frame, store, frame_range=None, workers=None, profiler=None):
+    """Render the frames in `frame_range` (start, stop; all by default) that `store` is missing.
+
+    Frames are rendered across `workers` processes like render_frames and
+    written to the store as they arrive. Returns the number of frames rendered.
+    """
+    start, stop = (0, store.n_frames) if frame_range is None else (int(frame_range[0]), int(frame_range[1]))
+    if not 0 <= start <= stop <= store.n_frames:
+        raise StoreMismatch(f"frame range {start} {stop} is outside the {store.n_frames} frames of {store.directory}")
+    todo = store.missing(start, stop)
+    frames = render_frames(lambda j: draw_frame(todo[j]), len(todo), workers)
+    if profiler is not None:
+        frames = profiler.frames(frames, len(todo))
+    for j, frame in enumerate(frames):
+        store.write(todo[j], frame)
+    return len(todo)
+
+def render_animation(draw_frame, n_frames, output_path, duration, store_key=None, frame_store=None, frame_range=None,
+                     workers=None, profiler=None):
+    """Render `n_frames` frames with draw_frame(i) and encode them to `output_path`.
+
+    With `frame_store` (a directory) the frames are checkpointed in a
+    FrameStore under `store_key`, only those in `frame_range` are rendered,
+    and the animation is encoded once the store is complete.
+    """
+    if profiler is None:
+        profiler = Profiler()
+    # Shared GIF palette from a few frames spread over the animation
+    samples = np.linspace(0, n_frames - 1, 4, dtype=int)
+    palette_frames = (draw_frame(i) for i in samples)
+
+    missing = 0
+    if frame_store is None:
+        frames = profiler.frames(render_frames(draw_frame, n_frames, workers), n_frames)
+    else:
+        # Checkpointed: frames go to disk as they finish and are encoded from there once all are done
+        store = FrameStore(frame_store, n_frames, key=store_key)
+        render_to_store(draw_frame, store, frame_range, workers, profiler)
+        missing = len(store.missing())
+        if missing:
+            print(f"{missing} frames still to render; run again without frame_range to finish and encode")
+        palette_frames = (store[i] for i in samples)
+        frames = store.frames()
+
+    if not missing:
+        with profiler.stage('palette'):
+            writer = open_writer(output_path, duration=duration, palette_frames=palette_frames)
+
+        with writer:
+            for frame in frames:
+                with profiler.stage('encode'):
+                    writer.write(frame)
+    profiler.report()
@@ -0,0 +1,246 @@
+import io
+import os
+import shutil
+import struct
+import subprocess
+import zlib
+import numpy as np
+from PIL import Image
+
+# Streaming animation writers. Each writer encodes a frame to disk as soon as
+# it is written and keeps at most the current and previous frame in memory, so a
+# render uses the same amount of memory for 10 frames as for 10 000.
+#
+# Frames are (height, width, 3 or 4) uint8 arrays, as returned by
+# BlitRenderer.render(), or PIL images.
+
+def open_writer(path, duration, loop=0, palette_frames=None):
+    """Open a streaming writer for `path`, chosen by its extension.
+
+    .gif writes an animated GIF, .png/.apng an animated PNG and .mp4 (or any
+    other extension) pipes raw frames into ffmpeg. `duration` is the display
+    time of each frame in milliseconds and `loop` the number of repeats
+    (0 = forever, ignored for video). `palette_frames` is an iterable of
+    sample frames for the shared GIF palette; other formats ignore it.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.gif':
+        return GifWriter(path, duration, loop, palette_frames)
+    if extension in ('.png', '.apng'):
+        return ApngWriter(path, duration, loop)
+    return FfmpegWriter(path, duration)
+
+def _as_array(frame):
+    if isinstance(frame, Image.Image):
+        frame = np.asarray(frame.convert('RGBA'))
+    return np.ascontiguousarray(frame, dtype=np.uint8)
+
+class _StreamWriter:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _gif_blocks(data, pos):
+    # Skip a run of GIF data sub-blocks starting at `pos`, return the offset after the terminator
+    while data[pos]:
+        pos += data[pos] + 1
+    return pos + 1
+
+def _encode_gif_image(image):
+    """LZW-encode a palette image with PIL and return its GIF image data.
+
+    The palette indices are kept as they are, so the data can be used with
+    any colour table that `image` was quantized against.
+    """
+    buf = io.BytesIO()
+    image.save(buf, format='GIF', interlace=False, optimize=False)
+    data = buf.getvalue()
+
+    flags = data[10]
+    pos = 13
+    if flags & 0x80:
+        pos += 3 * 2 ** ((flags & 0x07) + 1)
+
+    while data[pos] == 0x21:
+        pos = _gif_blocks(data, pos + 2)
+
+    # Image descriptor, optional local colour table, then the LZW stream
+    packed = data[pos + 9]
+    pos += 10
+    if packed & 0x80:
+        pos += 3 * 2 ** ((packed & 0x07) + 1)
+    end = _gif_blocks(data, pos + 1)
+    return data[pos:end]
+
+def _median_cut(pixels, colors):
+    # Median-cut palette of an (n, 1, 3) or (h, w, 3) array, as a flat list of RGB values
+    image = Image.fromarray(np.ascontiguousarray(pixels)).quantize(colors, method=Image.Quantize.MEDIANCUT)
+    return image.getpalette()[:3 * len(image.getcolors(colors))]
+
+def shared_palette(frames, colors=256, reserved=64):
+    """Median-cut palette computed over a sample of frames at once, as a 'P' image.
+
+    The first frame is taken as the background and gets `colors - reserved`
+    entries, computed from it subsampled 2x in each direction. The pixels of
+    the other frames that differ from it, the moving artists, get the
+    `reserved` entries of their own: they cover too few pixels to win
+    entries against the background in a single median cut.
+    """
+    frames = [_as_array(frame)[..., :3] for frame in frames]
+    background = frames[0]
+    changed = np.concatenate([frame[np.any(frame != background, axis=2)] for frame in frames[1:]] + [np.empty((0, 3), np.uint8)])
+
+    if len(changed):
+        palette = _median_cut(background[::2, ::2], colors - reserved)
+        palette += _median_cut(changed[:, None], colors - len(palette) // 3)
+    else:
+        palette = _median_cut(background[::2, ::2], colors)
+    palette_image = Image.new('P', (1, 1))
+    palette_image.putpalette(palette + [0] * (768 - len(palette)))
+    return palette_image
+
+def _changed_box(frame, previous):
+    # Bounding box (top, bottom, left, right) of the pixels that differ, None if none do
+    if frame.shape[2] == 4:
+        # Whole RGBA pixels compare as one uint32 each
+        changed = frame.view(np.uint32)[..., 0] != previous.view(np.uint32)[..., 0]
+    else:
+        changed = np.any(frame != previous, axis=2)
+    rows = np.flatnonzero(changed.any(axis=1))
+    if len(rows) == 0:
+        return None
+    cols = np.flatnonzero(changed[rows[0]:rows[-1] + 1].any(axis=0))
+    return rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+class GifWriter(_StreamWriter):
+    """Animated GIF written frame by frame with one global palette and delta frames.
+
+    The palette is computed once, from `palette_frames` if given (typically
+    a handful of frames spread over the animation) or else from the first
+    frame, so colours no longer flicker between frames. After the first
+    frame only the bounding box of the pixels that changed is quantized and
+    stored, on top of the previous frame.
+    """
+
+    def __init__(self, path, duration, loop=0, palette_frames=None):
+        self.file = open(path, 'wb')
+        self.delay = int(duration / 10)
+        self.loop = loop
+        self.palette = shared_palette(palette_frames) if palette_frames is not None else None
+        self.previous = None
+
+    def _write_header(self, width, height):
+        self.file.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0xf7, 0, 0))
+        self.file.write(bytes(self.palette.getpalette()[:768]))
+        self.file.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', self.loop) + b'\x00')
+
+    def _write_image(self, image_data, left, top, width, height):
+        # Disposal method 1: later frames are drawn on top of this one
+        self.file.write(b'\x21\xf9\x04' + struct.pack('<BHBB', 1 << 2, self.delay, 0, 0))
+        self.file.write(b'\x2c' + struct.pack('<HHHHB', left, top, width, height, 0))
+        self.file.write(image_data)
+
+    def write(self, frame):
+        frame = _as_array(frame)
+        if self.previous is None:
+            if self.palette is None:
+                self.palette = shared_palette([frame])
+            self._write_header(frame.shape[1], frame.shape[0])
+            box = 0, frame.shape[0], 0, frame.shape[1]
+        else:
+            # GIF frames cannot be empty, so an unchanged frame repeats a single pixel
+            box = _changed_box(frame, self.previous) or (0, 1, 0, 1)
+        top, bottom, left, right = box
+
+        region = Image.fromarray(frame[top:bottom, left:right, :3])
+        image = region.quantize(palette=self.palette, dither=Image.Dither.NONE)
+        self._write_image(_encode_gif_image(image), int(left), int(top), int(right - left), int(bottom - top))
+        self.previous = frame
+
+    def close(self):
+        if not self.file.closed:
+            self.file.write(b'\x3b')
+            self.file.close()
+
+def _png_chunk(kind, payload):
+    return struct.pack('>I', len(payload)) + kind + payload + struct.pack('>I', zlib.crc32(kind + payload))
+
+class ApngWriter(_StreamWriter):
+    """Animated PNG written frame by frame; the frame count is patched in on close."""
+
+    def __init__(self, path, duration, loop=0):
+        self.file = open(path, 'wb')
+        self.duration = int(duration)
+        self.loop = loop
+        self.size = None
+        self.sequence = 0
+        self.n_frames = 0
+
+    def _write_header(self, width, height):
+        self.size = (width, height)
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        self.file.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)))
+        self.actl_offset = self.file.tell()
+        self.file.write(_png_chunk(b'acTL', struct.pack('>II', 0, self.loop)))
+
+    def write(self, frame):
+        frame = _as_array(frame)
+        height, width = frame.shape[:2]
+        if self.size is None:
+            self._write_header(width, height)
+        if frame.shape[2] == 3:
+            frame = np.dstack([frame, np.full((height, width), 255, dtype=np.uint8)])
+
+        # Every scanline uses filter type 0, so the raw stream is a zero byte per row followed by the pixels
+        raw = np.zeros((height, 1 + 4 * width), dtype=np.uint8)
+        raw[:, 1:] = frame.reshape(height, -1)
+        compressed = zlib.compress(raw.tobytes(), 6)
+
+        self.file.write(_png_chunk(b'fcTL', struct.pack('>IIIIIHHBB', self.sequence, width, height, 0, 0,
+                                                        self.duration, 1000, 0, 0)))
+        self.sequence += 1
+        if self.n_frames == 0:
+            self.file.write(_png_chunk(b'IDAT', compressed))
+        else:
+            self.file.write(_png_chunk(b'fdAT', struct.pack('>I', self.sequence) + compressed))
+            self.sequence += 1
+        self.n_frames += 1
+
+    def close(self):
+        if not self.file.closed:
+            self.file.write(_png_chunk(b'IEND', b''))
+            if self.size is not None:
+                self.file.seek(self.actl_offset)
+                self.file.write(_png_chunk(b'acTL', struct.pack('>II', self.n_frames, self.loop)))
+            self.file.close()
+
+class FfmpegWriter(_StreamWriter):
+    """H.264 video written by piping raw RGBA frames into an ffmpeg process."""
+
+    def __init__(self, path, duration):
+        if shutil.which('ffmpeg') is None:
+            raise RuntimeError(f"writing {path!r} needs ffmpeg on the PATH; use a .gif or .png output instead")
+        self.path = path
+        self.fps = 1000 / duration
+        self.process = None
+
+    def write(self, frame):
+        frame = _as_array(frame)
+        height, width = frame.shape[:2]
+        if self.process is None:
+            pix_fmt = 'rgba' if frame.shape[2] == 4 else 'rgb24'
+            self.process = subprocess.Popen(
+                ['ffmpeg', '-loglevel', 'error', '-y',
+                 '-f', 'rawvideo', '-pix_fmt', pix_fmt, '-s', f'{width}x{height}', '-r', f'{self.fps:g}', '-i', '-',
+                 '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-c:v', 'libx264', '-pix_fmt', 'yuv420p', self.path],
+                stdin=subprocess.PIPE)
+        self.process.stdin.write(frame.tobytes())
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            if self.process.wait() != 0:
+                raise RuntimeError(f"ffmpeg failed while writing {self.path!r}")
+            self.process = None
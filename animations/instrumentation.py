@@ -0,0 +1,115 @@
+import contextlib
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Lightweight timing of the stages of a render.
+#
+#     profiler = Profiler()
+#     with profiler.stage('field'):
+#         ...
+#     for frame in profiler.frames(render_frames(draw_frame, n), n):
+#         with profiler.stage('encode'):
+#             writer.write(frame)
+#     profiler.report()
+#
+# The frame progress line (with frames per second and ETA) is always
+# printed. Stage timings, the summary table and the peak memory are only
+# collected when the profiler is enabled, by argument or by setting the
+# TLM_PROFILE environment variable; TLM_TRACE=path additionally writes a
+# Chrome trace (chrome://tracing, Perfetto) of every stage. Disabled stages
+# are a shared no-op context manager, so they cost next to nothing.
+
+_null_stage = contextlib.nullcontext()
+_done = object()
+
+def peak_rss():
+    """Peak resident set size in bytes of this process and of its finished children, or None."""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit)
+
+class Profiler:
+    def __init__(self, enabled=None, trace_path=None, progress_interval=0.0):
+        if trace_path is None:
+            trace_path = os.environ.get('TLM_TRACE') or None
+        if enabled is None:
+            enabled = os.environ.get('TLM_PROFILE', '') not in ('', '0') or trace_path is not None
+        self.enabled = enabled
+        self.trace_path = trace_path
+        self.progress_interval = progress_interval
+        self.totals = {}
+        self.counts = {}
+        self.events = []
+        self.frame_count = 0
+        self.start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def _timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.totals[name] = self.totals.get(name, 0.0) + end - start
+            self.counts[name] = self.counts.get(name, 0) + 1
+            if self.trace_path is not None:
+                self.events.append((name, start, end))
+
+    def stage(self, name):
+        """Context manager that adds the time spent inside it to stage `name`."""
+        return self._timed(name) if self.enabled else _null_stage
+
+    def frames(self, frames, total):
+        """Iterate over `frames`, timing the wait for each as the 'render' stage and printing progress."""
+        frames = iter(frames)
+        start = time.perf_counter()
+        last_print = -float('inf')
+        i = 0
+        while True:
+            with self.stage('render'):
+                frame = next(frames, _done)
+            if frame is _done:
+                return
+            yield frame
+
+            i += 1
+            self.frame_count = i
+            now = time.perf_counter()
+            if now - last_print >= self.progress_interval or i == total:
+                last_print = now
+                fps = i / (now - start)
+                print(f"Frame {i}/{total}  {fps:.2f} fps  ETA {max(total - i, 0) / fps:.0f} s")
+
+    def report(self):
+        """Print the per-stage summary and write the trace, if enabled."""
+        if not self.enabled:
+            return
+        wall = time.perf_counter() - self.start
+        print(f"\n{'stage':20s} {'calls':>7s} {'total s':>9s} {'mean ms':>9s} {'share':>6s}")
+        for name, total in sorted(self.totals.items(), key=lambda item: -item[1]):
+            count = self.counts[name]
+            print(f"{name:20s} {count:7d} {total:9.2f} {total / count * 1e3:9.1f} {total / wall:6.1%}")
+        print(f"{'wall':20s} {'':7s} {wall:9.2f}")
+        if self.frame_count:
+            print(f"{self.frame_count / wall:.2f} frames per second overall")
+        rss = peak_rss()
+        if rss is not None:
+            print(f"peak RSS {rss[0] / 2**20:.0f} MiB (this process), {rss[1] / 2**20:.0f} MiB (largest worker)")
+
+        if self.trace_path is not None:
+            pid = os.getpid()
+            events = [{'name': name, 'ph': 'X', 'pid': pid, 'tid': 0,
+                       'ts': (start - self.start) * 1e6, 'dur': (end - start) * 1e6}
+                      for name, start, end in self.events]
+            with open(self.trace_path, 'w') as f:
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
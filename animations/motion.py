@@ -0,0 +1,135 @@
+import numpy as np
+
+# Closed-loop position control of the carriage.
+#
+# The carriage is a mass on a rail, pushed by the winding and slowed by
+# viscous and Coulomb friction. A PID position controller sets a signed
+# current amplitude, which is commutated onto the three phases as
+#
+#     angle = 2 pi position / period + commutation_angle
+#
+# (see carriage.thrust_metrics for the commutation angle). The state of a
+# run is (position, velocity, integral of the position error); every
+# parameter may be an array, and the runs of all broadcast combinations are
+# integrated together, so hundreds of gain sets or reference profiles cost
+# about as much as one.
+#
+# `force` is a callable force(positions, angles, amplitudes) -> (Fx, Fy), for
+# example ForceTable(path).force_from_angle or
+# functools.partial(carriage_force, field).
+
+def reciprocating_profile(t, stroke, move_time, dwell_time=0.0):
+    """Reference (position, velocity) moving 0 -> stroke -> 0 and repeating.
+
+    Each move follows a cosine velocity profile over `move_time` and is
+    followed by a dwell of `dwell_time`.
+    """
+    t = np.asarray(t, dtype=float)
+    cycle = 2 * (move_time + dwell_time)
+    s = np.mod(t, cycle)
+    back = s >= move_time + dwell_time
+    s = np.clip(np.where(back, s - move_time - dwell_time, s) / move_time, 0, 1)
+    position = stroke * (1 - np.cos(np.pi * s)) / 2
+    velocity = np.where(s < 1, stroke * np.pi / (2 * move_time) * np.sin(np.pi * s), 0.0)
+    return np.where(back, stroke - position, position), np.where(back, -velocity, velocity)
+
+def _controller(t, state, force, reference, params):
+    position, velocity, integral = state
+    target, target_velocity = reference(t)
+    error = target - position
+    current = params['kp'] * error + params['ki'] * integral + params['kd'] * (target_velocity - velocity)
+    current = np.clip(current, -params['max_current'], params['max_current'])
+    angle = 2 * np.pi * position / params['period'] + params['commutation_angle']
+    Fx, _ = force(position, angle, current)
+    friction = params['damping'] * velocity + params['coulomb'] * np.tanh(velocity / params['stiction_velocity'])
+    return np.stack([velocity, (Fx - friction) / params['mass'], error]), current
+
+# Dormand-Prince 5(4) tableau
+_dp_c = np.array([0, 1/5, 3/10, 4/5, 8/9, 1, 1])
+_dp_a = [
+    [],
+    [1/5],
+    [3/40, 9/40],
+    [44/45, -56/15, 32/9],
+    [19372/6561, -25360/2187, 64448/6561, -212/729],
+    [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+    [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84],
+]
+_dp_error = np.array([71/57600, 0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40])
+
+def simulate(force, reference, t_end, dt, mass, period, kp, ki=0.0, kd=0.0, commutation_angle=0.0,
+             max_current=np.inf, damping=0.0, coulomb=0.0, stiction_velocity=1e-3, position=0.0,
+             velocity=0.0, method='rk4', rtol=1e-6, atol=1e-9, max_step=None):
+    """Simulate the position-controlled carriage from t = 0 to `t_end`.
+
+    `reference(t)` returns the target (position, velocity) at time t. With
+    method='rk4' the equations are integrated with a fixed step `dt`; with
+    method='adaptive' `dt` is the first step of an embedded Dormand-Prince
+    5(4) scheme whose shared step is chosen so that every run in the batch
+    meets `rtol`/`atol`.
+
+    Returns a dict with the time 't' of shape (steps,) and 'position',
+    'velocity', 'current', 'reference_position' and 'reference_velocity'
+    of shape (steps,) + batch shape.
+    """
+    if method not in ('rk4', 'adaptive'):
+        raise ValueError(f"unknown integration method {method!r}")
+    params = dict(mass=mass, period=period, kp=kp, ki=ki, kd=kd, commutation_angle=commutation_angle,
+                  max_current=max_current, damping=damping, coulomb=coulomb, stiction_velocity=stiction_velocity)
+    params = {name: np.asarray(value, dtype=float) for name, value in params.items()}
+    batch = np.broadcast_shapes(np.shape(position), np.shape(velocity), np.shape(reference(0.0)[0]),
+                                *(value.shape for value in params.values()))
+    state = np.zeros((3,) + batch)
+    state[0] = position
+    state[1] = velocity
+
+    def derivative(t, state):
+        return _controller(t, state, force, reference, params)
+
+    times = [0.0]
+    states = [state]
+    currents = [derivative(0.0, state)[1]]
+    t = 0.0
+    step = dt
+
+    while t < t_end - 1e-12 * t_end:
+        step = min(step, t_end - t)
+        if method == 'rk4':
+            k1, _ = derivative(t, state)
+            k2, _ = derivative(t + step / 2, state + step / 2 * k1)
+            k3, _ = derivative(t + step / 2, state + step / 2 * k2)
+            k4, _ = derivative(t + step, state + step * k3)
+            state = state + step / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+            t += step
+        else:
+            k = [derivative(t, state)[0]]
+            for c, a in zip(_dp_c[1:], _dp_a[1:]):
+                k.append(derivative(t + c * step, state + step * sum(w * kj for w, kj in zip(a, k) if w))[0])
+            new_state = state + step * sum(w * kj for w, kj in zip(_dp_a[-1], k) if w)
+            error = step * sum(w * kj for w, kj in zip(_dp_error, k) if w)
+            scale = atol + rtol * np.maximum(np.abs(state), np.abs(new_state))
+            norm = np.max(np.abs(error) / scale) if error.size else 0.0
+            factor = 5.0 if norm == 0 else min(5.0, max(0.2, 0.9 * norm ** -0.2))
+            if norm > 1:
+                step *= factor
+                continue
+            t += step
+            state = new_state
+            step *= factor
+            if max_step is not None:
+                step = min(step, max_step)
+        times.append(t)
+        states.append(state)
+        currents.append(derivative(t, state)[1])
+
+    times = np.array(times)
+    states = np.array(states)
+    target, target_velocity = reference(times.reshape((-1,) + (1,) * len(batch)))
+    return {
+        't': times,
+        'position': states[:, 0],
+        'velocity': states[:, 1],
+        'current': np.broadcast_to(np.array(currents), states[:, 0].shape),
+        'reference_position': np.broadcast_to(target, states[:, 0].shape),
+        'reference_velocity': np.broadcast_to(target_velocity, states[:, 0].shape),
+    }
@@ -0,0 +1,176 @@
+import numpy as np
+from magnet_field import array_field
+
+# Field of periodic magnet arrays.
+#
+# With reverse_every_other = True the array repeats every two magnets, so the
+# sources of one period (a "cell", packed like magnet_sources) describe it
+# completely. In complex form every monopole contributes
+#
+#     Bx - i By = q / (z - z_s),    z = x + i y,
+#
+# and summing a cell over all periods gives (pi q / P) cot(pi (z - z_s) / P).
+# Above (or below) every source that sum is a Fourier series in x whose
+# terms decay as exp(-2 pi k |y| / P), so a few harmonics evaluate the field
+# of an arbitrarily long array, and the coefficients are its harmonic content.
+
+def array_cell(sources, magnets_per_cell=2):
+    """Split packed sources of a periodic array into (cell, n_cells).
+
+    The cell is the sources of the first `magnets_per_cell` magnets; any
+    magnets beyond the last whole cell are ignored.
+    """
+    sources = np.asarray(sources, dtype=float)
+    per_cell = 2 * magnets_per_cell
+    return sources[:per_cell], len(sources) // per_cell
+
+def harmonic_coefficients(cell, period, n_harmonics, side=1):
+    """Fourier coefficients c_0..c_K of Bx - i By for the infinite periodic array.
+
+    For side=1 (points above every source) Bx - i By = sum_k c_k exp(2 pi i k z / P);
+    for side=-1 (below every source) it is sum_k c_k exp(-2 pi i k z / P).
+    """
+    cell = np.asarray(cell, dtype=float)
+    zs = cell[:, 0] + 1j * cell[:, 1]
+    q = cell[:, 2]
+    k = np.arange(n_harmonics + 1)
+    coefficients = -side * 2j * np.pi / period * (np.exp(-side * 2j * np.pi * np.outer(k, zs) / period) @ q)
+    coefficients[0] /= 2
+    return coefficients
+
+def harmonic_content(cell, period, y, n_harmonics=15):
+    """Harmonic content of By along the line at height `y`.
+
+    Returns (orders, amplitudes, phases) such that
+    By(x) = sum_k amplitudes[k] * cos(2 pi orders[k] x / period + phases[k]) for k >= 1
+    (orders[0] = 0 is the constant term). `y` must lie above or below every source.
+    """
+    ys = np.asarray(cell)[:, 1]
+    if y > ys.max():
+        side = 1
+    elif y < ys.min():
+        side = -1
+    else:
+        raise ValueError("harmonic content is only defined above or below all sources")
+
+    orders = np.arange(n_harmonics + 1)
+    # Each term of Bx - i By at height y is a_k exp(side * 2 pi i k x / P)
+    a = harmonic_coefficients(cell, period, n_harmonics, side) * np.exp(-side * 2 * np.pi * orders * y / period)
+    amplitudes = np.abs(a)
+    phases = side * (np.angle(a) + np.pi / 2)
+    amplitudes[0] = -a[0].imag
+    phases[0] = 0
+    return orders, amplitudes, phases
+
+def _split(B):
+    return B.real, -B.imag
+
+def _cot_sum(z, cell, period):
+    # Exact infinite-array field: sum over the cell of (pi q / P) cot(pi (z - z_s) / P)
+    B = np.zeros(z.shape, dtype=complex)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for sx, sy, q in cell:
+            B += q * np.pi / period / np.tan(np.pi * (z - (sx + 1j * sy)) / period)
+    return B
+
+def periodic_field(x, y, cell, period, n_harmonics=None):
+    """Field of the infinite array made by repeating `cell` every `period`.
+
+    With n_harmonics=None the closed form (one cotangent per cell source)
+    is used, which is exact everywhere. Otherwise points above or below every
+    source are evaluated with the truncated harmonic series, in
+    O(n_harmonics x points) time, and only the points level with the sources
+    fall back to the closed form.
+    """
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    cell = np.asarray(cell, dtype=float)
+    z = x + 1j * y
+    if n_harmonics is None:
+        return _split(_cot_sum(z, cell, period))
+
+    B = np.zeros(z.shape, dtype=complex)
+    above = y > cell[:, 1].max()
+    below = y < cell[:, 1].min()
+    for side, mask in ((1, above), (-1, below)):
+        coefficients = harmonic_coefficients(cell, period, n_harmonics, side)
+        w = np.exp(side * 2j * np.pi * z[mask] / period)
+        # Horner's scheme: one pass over the points per harmonic, no (harmonics x points) temporary
+        series = np.full(w.shape, coefficients[-1])
+        for c in coefficients[-2::-1]:
+            series = series * w + c
+        B[mask] = series
+    level = ~(above | below)
+    B[level] = _cot_sum(z[level], cell, period)
+    return _split(B)
+
+def _digamma(z):
+    # Complex digamma: reflection into Re(z) >= 0.5, recurrence up to Re(z) >= 6.5, then the asymptotic series
+    z = np.asarray(z, dtype=complex)
+    reflect = z.real < 0.5
+    w = np.where(reflect, 1 - z, z)
+    result = np.zeros(w.shape, dtype=complex)
+    for _ in range(6):
+        result -= 1 / w
+        w = w + 1
+    w2 = 1 / (w * w)
+    result += np.log(w) - 0.5 / w - w2 * (1/12 - w2 * (1/120 - w2 * (1/252 - w2 * (1/240 - w2 / 132))))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(reflect, result - np.pi / np.tan(np.pi * z), result)
+
+def finite_periodic_field(x, y, cell, period, n_cells):
+    """Exact field of `n_cells` consecutive copies of `cell`, starting at the cell itself.
+
+    This is the periodic solution with its end effects included: the sum over
+    copies n = 0..n_cells-1 of q / (z - z_s - n P) is written with the digamma
+    function, so the cost is O(cell sources x points) whatever the array length.
+    """
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    z = x + 1j * y
+    B = np.zeros(z.shape, dtype=complex)
+    for sx, sy, q in np.asarray(cell, dtype=float):
+        a = (z - (sx + 1j * sy)) / period
+        B -= q / period * (_digamma(n_cells - a) - _digamma(-a))
+    return _split(B)
+
+def periodic_array_field(x, y, sources, magnets_per_cell=2):
+    """Exact field of packed `sources` of a periodic array, like magnet_field.array_field.
+
+    The whole cells are summed with finite_periodic_field, so the cost stays
+    the same however long the array is; the magnets after the last whole
+    cell are added directly. As in array_field, a target that sits on a
+    source gets no contribution from it. Raises ValueError if the cells of
+    `sources` are not shifted copies of the first one.
+    """
+    sources = np.asarray(sources, dtype=float).reshape(-1, 3)
+    cell, n_cells = array_cell(sources, magnets_per_cell)
+    if n_cells < 2:
+        return array_field(x, y, sources)
+    period = sources[len(cell), 0] - sources[0, 0]
+    cells = sources[:n_cells * len(cell)].reshape(n_cells, len(cell), 3)
+    shifts = np.zeros((n_cells, 1, 3))
+    shifts[:, 0, 0] = period * np.arange(n_cells)
+    if not np.allclose(cells, cell + shifts, atol=1e-9 * max(1.0, abs(period) * n_cells)):
+        raise ValueError(f"the sources do not repeat every {magnets_per_cell} magnets, so the periodic solver cannot be used")
+
+    # The closed form has a pole a whole number of periods from each cell
+    # source (every source, and the leftover magnets past the last cell),
+    # where array_field leaves the coincident source out instead; such
+    # targets are few, so they are summed directly
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    on_source = np.zeros(x.shape, dtype=bool)
+    for sx, sy, _ in cell:
+        a = (x - sx + 1j * (y - sy)) / period
+        n = np.rint(a.real)
+        on_source |= np.abs(a - n) < 1e-9
+    off = ~on_source
+
+    Bx, By = np.empty(x.shape), np.empty(x.shape)
+    Bx[off], By[off] = finite_periodic_field(x[off], y[off], cell, period, n_cells)
+    rest = sources[n_cells * len(cell):]
+    if len(rest):
+        Bx_rest, By_rest = array_field(x[off], y[off], rest)
+        Bx[off] += Bx_rest
+        By[off] += By_rest
+    if on_source.any():
+        Bx[on_source], By[on_source] = array_field(x[on_source], y[on_source], sources)
+    return Bx, By
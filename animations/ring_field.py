@@ -0,0 +1,134 @@
+import numpy as np
+
+# Axisymmetric field model of the tubular motor.
+#
+# The planar scripts treat every pole as a line monopole. In the real,
+# tubular motor the magnets are cylinders on the axis and each pole face is
+# a disc of magnetic charge. Here a face is modelled as one or more rings of
+# charge (z_s, a, q): axial position, radius and total charge, packed like
+# magnet_sources. With the point-charge law q r_hat / (4 pi |r|^2), a ring
+# gives, at axial position z and radius r, with dz = z - z_s,
+#
+#     s = (a + r)^2 + dz^2,   d = (a - r)^2 + dz^2,   m = 4 a r / s,
+#     Bz = q dz E(m) / (2 pi^2 d sqrt(s)),
+#     Br = q (K(m) - (a^2 - r^2 + dz^2) E(m) / d) / (4 pi^2 r sqrt(s)),
+#
+# with the complete elliptic integrals K and E, evaluated with the
+# arithmetic-geometric mean. Fields are returned as (Bz, Br) in place of
+# (Bx, By), with x the axial and y the radial coordinate; a negative y is
+# the opposite side of the axis, where Br changes sign. That makes ring_field
+# a drop-in `field` for the force and EMF functions of carriage.py.
+
+def elliptic_ke(m, max_iterations=12):
+    """Complete elliptic integrals (K(m), E(m)) for parameter 0 <= m < 1, by the AGM."""
+    m = np.asarray(m, dtype=float)
+    a = np.ones_like(m)
+    b = np.sqrt(1 - m)
+    c_squared_sum = 0.5 * m
+    power = 0.5
+    # Quadratic convergence: about six steps for m up to 1 - 1e-12, all points stepping together
+    for _ in range(max_iterations):
+        c = (a - b) / 2
+        if not c.size or np.max(c) < 1e-16:
+            break
+        a, b = (a + b) / 2, np.sqrt(a * b)
+        power *= 2
+        c_squared_sum += power * c * c
+    K = np.pi / (2 * a)
+    return K, K * (1 - c_squared_sum)
+
+def magnet_rings(magnets, strength, n_rings=1):
+    """Pack the pole faces of `magnets` into an (n, 3) array of (z, a, q) rings.
+
+    The magnets are the tuples of magnet_field.magnet_array, read as
+    cylinders: x is the axial position and the magnet height is the
+    diameter. Each face is split into `n_rings` equal-area rings that share
+    its charge.
+    """
+    radii = np.sqrt((np.arange(n_rings) + 0.5) / n_rings)
+    rings = []
+    for _, _, _, height, north_x, _, south_x, _ in magnets:
+        for pole_x, q in ((north_x, strength), (south_x, -strength)):
+            for radius in radii * height / 2:
+                rings.append((pole_x, radius, q / n_rings))
+    return np.array(rings)
+
+def ring_coupling(z, r, rings):
+    """Field per unit charge of every ring at the points (z, r).
+
+    Returns (Gz, Gr) of shape points.shape + (n_rings,), which depend only
+    on the geometry: the field for charges q is (Gz @ q, Gr @ q).
+    """
+    z, r = np.broadcast_arrays(np.asarray(z, dtype=float), np.asarray(r, dtype=float))
+    rings = np.asarray(rings, dtype=float).reshape(-1, 3)
+    side = np.where(r < 0, -1.0, 1.0)[..., None]
+    r = np.abs(r)[..., None]
+    dz = z[..., None] - rings[:, 0]
+    a = rings[:, 1]
+
+    s = (a + r)**2 + dz**2
+    d = (a - r)**2 + dz**2
+    d[d == 0] = 1e-12
+    root_s = np.sqrt(s)
+    K, E = elliptic_ke(np.minimum(4 * a * r / s, 1 - 1e-16))
+    Gz = dz * E / (2 * np.pi**2 * d * root_s)
+    # Br vanishes on the axis, where the bracket and r both go to zero
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Gr = (K - (a * a - r * r + dz * dz) * E / d) / (4 * np.pi**2 * r * root_s)
+    Gr = np.where(r > 1e-12, Gr, 0.0) * side
+    return Gz, Gr
+
+class RingField:
+    """Field of a set of rings, with the geometry terms kept for targets that are queried again.
+
+    Calls with the same target points (e.g. the wire positions of a force
+    sweep run for several magnet strengths) reuse the elliptic terms and
+    cost one matrix product. Coupling matrices are only kept while their
+    total size stays under `max_cached` entries. `charges` replaces the
+    ring charges and may have leading sample axes, which then lead the
+    result, for batches of perturbed magnets.
+    """
+
+    def __init__(self, rings, chunk_size=2**18, max_cached=2**22):
+        self.rings = np.asarray(rings, dtype=float).reshape(-1, 3)
+        self.chunk_size = chunk_size
+        self.max_cached = max_cached
+        self._cache = {}
+        self._cached_entries = 0
+
+    def _coupling(self, z, r):
+        key = (z.shape, z.tobytes(), r.tobytes())
+        if key in self._cache:
+            return self._cache[key]
+        coupling = ring_coupling(z, r, self.rings)
+        if self._cached_entries + z.size * len(self.rings) <= self.max_cached:
+            self._cache[key] = coupling
+            self._cached_entries += z.size * len(self.rings)
+        return coupling
+
+    def __call__(self, z, r, charges=None):
+        z, r = np.broadcast_arrays(np.asarray(z, dtype=float), np.asarray(r, dtype=float))
+        q = self.rings[:, 2] if charges is None else np.asarray(charges, dtype=float)
+        if z.size * len(self.rings) <= self.max_cached:
+            Gz, Gr = self._coupling(z, r)
+            return _apply(Gz, q), _apply(Gr, q)
+
+        # Too many points to keep: evaluate in chunks without caching
+        tz, tr = z.ravel(), r.ravel()
+        Bz = np.empty(q.shape[:-1] + tz.shape)
+        Br = np.empty(q.shape[:-1] + tz.shape)
+        step = max(1, self.chunk_size // len(self.rings))
+        for lo in range(0, len(tz), step):
+            Gz, Gr = ring_coupling(tz[lo:lo + step], tr[lo:lo + step], self.rings)
+            Bz[..., lo:lo + step] = _apply(Gz, q)
+            Br[..., lo:lo + step] = _apply(Gr, q)
+        return Bz.reshape(q.shape[:-1] + z.shape), Br.reshape(q.shape[:-1] + z.shape)
+
+def _apply(G, q):
+    # G is points.shape + (n_rings,), q is samples + (n_rings,): result samples + points.shape
+    G_flat = G.reshape(-1, G.shape[-1])
+    return (q.reshape(-1, q.shape[-1]) @ G_flat.T).reshape(q.shape[:-1] + G.shape[:-1])
+
+def ring_field(z, r, rings):
+    """Axial and radial field (Bz, Br) of `rings` at (z, r); see RingField to reuse the geometry."""
+    return RingField(rings)(z, r)
@@ -0,0 +1,40 @@
+import ast
+
+# Parameter overrides for the step scripts.
+#
+# Each step script calls apply_overrides(globals()) after its blocks of
+# parameters. Run on its own that does nothing; run through tlm.py, the
+# values of the parameter file and command-line options replace the
+# script's own before anything is computed from them.
+
+overrides = {}
+
+def apply_overrides(namespace):
+    """Replace the parameters already defined in `namespace` by their overrides."""
+    for name, value in overrides.items():
+        if name in namespace:
+            namespace[name] = value
+
+def _is_apply_call(node):
+    return (isinstance(node, ast.Expr) and isinstance(node.value, ast.Call)
+            and isinstance(node.value.func, ast.Name) and node.value.func.id == 'apply_overrides')
+
+def script_parameters(path):
+    """Names the script at `path` can take overrides for.
+
+    These are the names assigned in the unbroken runs of top-level
+    assignments that end in an apply_overrides call: the parameter blocks.
+    """
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+    block = set()
+    parameters = set()
+    for node in tree.body:
+        if _is_apply_call(node):
+            parameters |= block
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            block.update(target.id for target in targets if isinstance(target, ast.Name))
+            continue
+        block = set()
+    return parameters
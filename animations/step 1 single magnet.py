@@ -1,22 +1,9 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
-
-plt.rcParams['savefig.dpi'] = 800
-
-def monopole_field(x, y, mx, my, q):
-    r_squared = (x - mx)**2 + (y - my)**2
-    r_squared[r_squared == 0] = 1e-12
-    Bx = q * (x - mx) / r_squared
-    By = q * (y - my) / r_squared
-    return Bx, By
-
-def bar_magnet_field(x, y, x1, y1, x2, y2, strength):
-    Bx1, By1 = monopole_field(x, y, x1, y1, strength)
-    Bx2, By2 = monopole_field(x, y, x2, y2, -strength)
-    Bx = Bx1 + Bx2
-    By = By1 + By2
-    return Bx, By
+from magnet_field import bar_magnet_field
+from streamlines import trace_streamlines, draw_streamlines
+from script_params import apply_overrides
 
 # Parameters for a single magnet
 strength = 5
@@ -27,6 +14,11 @@ dipole_inset = 0.2
 xbrim = 3
 yrange = 3.5
 field_density = 1
+dpi = 800
+output_path = None  # save the figure here instead of showing it
+apply_overrides(globals())  # values given to tlm.py
+
+plt.rcParams['savefig.dpi'] = dpi
 
 # Grid setup
 x = np.linspace(-xbrim, length + xbrim, 200)
@@ -44,7 +36,8 @@ Bx, By = bar_magnet_field(X, Y, north_x, 0, south_x, 0, strength)
 
 # Plot vector field
 plt.figure(figsize=(12, 6))
-plt.streamplot(X, Y, Bx, By, color=np.log(np.sqrt(Bx**2 + By**2)), cmap='viridis', density=field_density, zorder=1, linewidth=2, arrowsize=1.5)
+streamlines = trace_streamlines(x, y, Bx, By, density=field_density)
+draw_streamlines(plt.gca(), streamlines, x, y, np.log(np.sqrt(Bx**2 + By**2)), cmap='viridis', zorder=1, linewidth=2, arrowsize=1.5)
 
 # Plot the magnet rectangle
 ax = plt.gca()
@@ -60,4 +53,7 @@ plt.gca().set_aspect('equal', adjustable='box')
 plt.xticks([])
 plt.yticks([])
 plt.grid(False)
-plt.show()
\ No newline at end of file
+if output_path:
+    plt.savefig(output_path)
+else:
+    plt.show()
\ No newline at end of file
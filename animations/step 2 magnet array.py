@@ -1,22 +1,9 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
-
-plt.rcParams['savefig.dpi'] = 800
-
-def monopole_field(x, y, mx, my, q):
-    r_squared = (x - mx)**2 + (y - my)**2
-    r_squared[r_squared == 0] = 1e-12
-    Bx = q * (x - mx) / r_squared
-    By = q * (y - my) / r_squared
-    return Bx, By
-
-def bar_magnet_field(x, y, x1, y1, x2, y2, strength):
-    Bx1, By1 = monopole_field(x, y, x1, y1, strength)
-    Bx2, By2 = monopole_field(x, y, x2, y2, -strength)
-    Bx = Bx1 + Bx2
-    By = By1 + By2
-    return Bx, By
+from magnet_field import magnet_array, magnet_sources, array_field
+from streamlines import trace_streamlines, draw_streamlines
+from script_params import apply_overrides
 
 # Parameters
 n_magnets = 8
@@ -31,6 +18,11 @@ reverse_every_other = True  # Set to False for all aligned
 xbrim = 3
 yrange = 10
 field_density = 2  # density of vector field arrows
+dpi = 800
+output_path = None  # save the figure here instead of showing it
+apply_overrides(globals())  # values given to tlm.py
+
+plt.rcParams['savefig.dpi'] = dpi
 
 # Calculate total length including gaps
 total_length = n_magnets * length + (n_magnets - 1) * gap
@@ -41,34 +33,16 @@ x = np.linspace(-1*xbrim - center_shift, n_magnets * (length + gap) + xbrim - ce
 y = np.linspace(-1*yrange/2, yrange/2, int(yrange*40))
 X, Y = np.meshgrid(x, y)
 
-Bx_total = np.zeros_like(X)
-By_total = np.zeros_like(Y)
-
-magnets = []
-
-for i in range(n_magnets):
-    # Position the magnet start, respecting the gap between magnets, then shift left to center at zero
-    start_x = i * (length + gap) - center_shift
-    end_x = start_x + length
-    
-    # Calculate dipole positions inset from edges
-    if reverse_every_other and i % 2 == 1:
-        north_x = end_x - dipole_inset
-        south_x = start_x + dipole_inset
-    else:
-        north_x = start_x + dipole_inset
-        south_x = end_x - dipole_inset
-    
-    magnets.append((start_x, 0, length, height, north_x, 0, south_x, 0))
+# Position the magnets, respecting the gap between them, centred at zero
+magnets = magnet_array(n_magnets, length, gap, height, dipole_inset, reverse_every_other)
 
-    # Add the field of this magnet
-    Bx, By = bar_magnet_field(X, Y, north_x, 0, south_x, 0, strength)
-    Bx_total += Bx
-    By_total += By
+# Superpose the field of every pole in one pass
+Bx_total, By_total = array_field(X, Y, magnet_sources(magnets, strength))
 
 # Plot vector field
 plt.figure(figsize=(12, 6))
-plt.streamplot(X, Y, Bx_total, By_total, color=np.log(np.sqrt(Bx_total**2 + By_total**2)), cmap='viridis', density=field_density, linewidth=2, arrowsize=1.5, zorder=1)
+streamlines = trace_streamlines(x, y, Bx_total, By_total, density=field_density)
+draw_streamlines(plt.gca(), streamlines, x, y, np.log(np.sqrt(Bx_total**2 + By_total**2)), cmap='viridis', linewidth=2, arrowsize=1.5, zorder=1)
 
 # Plot magnets as rectangles and dipoles as red/blue dots
 ax = plt.gca()
@@ -86,4 +60,7 @@ plt.gca().set_aspect('equal', adjustable='box')  # match aspect ratio
 plt.xticks([])
 plt.yticks([])
 plt.grid(False)
-plt.show()
\ No newline at end of file
+if output_path:
+    plt.savefig(output_path)
+else:
+    plt.show()
\ No newline at end of file
@@ -3,19 +3,15 @@ import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 import imageio
 from PIL import Image
-import io
-
-def monopole_field(x, y, mx, my, q):
-    r_squared = (x - mx)**2 + (y - my)**2
-    r_squared[r_squared == 0] = 1e-12
-    Bx = q * (x - mx) / r_squared
-    By = q * (y - my) / r_squared
-    return Bx, By
-
-def bar_magnet_field(x, y, x1, y1, x2, y2, strength):
-    Bx1, By1 = monopole_field(x, y, x1, y1, strength)
-    Bx2, By2 = monopole_field(x, y, x2, y2, -strength)
-    return Bx1 + Bx2, By1 + By2
+import functools
+from matplotlib.figure import Figure
+from magnet_field import magnet_array, magnet_sources, array_field
+from frame_render import BlitRenderer
+from frame_store import render_animation
+from field_cache import FieldCache
+from instrumentation import Profiler
+from streamlines import trace_streamlines, draw_streamlines
+from script_params import apply_overrides
 
 # almost no effect on the field from the wire, so we can use a simplified model for faster rendering
 #def current_carrying_wire_field(x, y, x0, y0, I):
@@ -37,6 +33,8 @@ reverse_every_other = True
 xbrim = 3
 yrange = 8
 field_density = 2.5
+dpi = 450  # of the field background and the frames
+apply_overrides(globals())  # values given to tlm.py
 
 total_length = n_magnets * length + (n_magnets - 1) * gap
 center_shift = total_length / 2
@@ -45,60 +43,66 @@ x = np.linspace(-1*xbrim - center_shift, n_magnets * (length + gap) + xbrim - ce
 y = np.linspace(-1*yrange/2, yrange/2, int(yrange*50))
 X, Y = np.meshgrid(x, y)
 
-# Precompute magnetic field from magnets
-Bx_total = np.zeros_like(X)
-By_total = np.zeros_like(Y)
-magnets = []
+# Precompute magnetic field from magnets, or reuse it from an earlier run with the same geometry and grid
+cache = FieldCache()
+profiler = Profiler()  # TLM_PROFILE=1 prints per-stage timings, TLM_TRACE=path writes a Chrome trace
+magnets = magnet_array(n_magnets, length, gap, height, dipole_inset, reverse_every_other)
+sources = magnet_sources(magnets, strength)
+field_key = cache.key(kind='pm_field', sources=sources, x=(x[0], x[-1], len(x)), y=(y[0], y[-1], len(y)))
+with profiler.stage('field'):
+    Bx_total, By_total = cache.arrays(field_key, ('Bx', 'By'), lambda: array_field(X, Y, sources))
+
+# Streamline geometry is in data coordinates, so it is traced once for any dpi or figure size
+streamline_key = cache.key(kind='streamlines', field=field_key, density=field_density)
+streamline_names = ('points', 'offsets', 'arrows')
+with profiler.stage('streamlines'):
+    streamlines = dict(zip(streamline_names, cache.arrays(streamline_key, streamline_names,
+                                                          lambda: trace_streamlines(x, y, Bx_total, By_total, field_density).values())))
+
+# Pre-render the field background
+def render_background(path):
+    fig, ax = plt.subplots(figsize=(12,6))
+    draw_streamlines(ax, streamlines, x, y, np.log(np.sqrt(Bx_total**2 + By_total**2)), cmap='viridis', linewidth=2, arrowsize=1.5, zorder=1)
 
-for i in range(n_magnets):
-    start_x = i * (length + gap) - center_shift
-    end_x = start_x + length
-    if reverse_every_other and i % 2 == 1:
-        north_x = end_x - dipole_inset
-        south_x = start_x + dipole_inset
-    else:
-        north_x = start_x + dipole_inset
-        south_x = end_x - dipole_inset
+    for (start_x, start_y, width, height, north_x, north_y, south_x, south_y) in magnets:
+        rect = patches.Rectangle((start_x, -height/2), width, height, linewidth=1, edgecolor='black', facecolor='grey', zorder=2)
+        ax.add_patch(rect)
+        ax.scatter([north_x, south_x], [north_y, south_y], c=['red', 'blue'], s=75, zorder=3)
 
-    magnets.append((start_x, 0, length, height, north_x, 0, south_x, 0))
+    ax.set_xlim(x.min(), x.max())
+    ax.set_ylim(-yrange/2, yrange/2)
+    ax.set_xticks([])
+    ax.set_yticks([])
+    ax.grid(False)
+    fig.tight_layout()
 
-    Bx, By = bar_magnet_field(X, Y, north_x, 0, south_x, 0, strength)
-    Bx_total += Bx
-    By_total += By
+    fig.savefig(path, format='png', bbox_inches='tight', pad_inches=0, dpi=dpi)
+    plt.close(fig)
 
-# Pre-render the field background
-fig, ax = plt.subplots(figsize=(12,6))
-ax.streamplot(X, Y, Bx_total, By_total, color=np.log(np.sqrt(Bx_total**2 + By_total**2)), cmap='viridis', density=field_density, linewidth=2, arrowsize=1.5, zorder=1)
-
-for (start_x, start_y, width, height, north_x, north_y, south_x, south_y) in magnets:
-    rect = patches.Rectangle((start_x, -height/2), width, height, linewidth=1, edgecolor='black', facecolor='grey', zorder=2)
-    ax.add_patch(rect)
-    ax.scatter([north_x, south_x], [north_y, south_y], c=['red', 'blue'], s=75, zorder=3)
-
-ax.set_xlim(x.min(), x.max())
-ax.set_ylim(-yrange/2, yrange/2)
-ax.set_xticks([])
-ax.set_yticks([])
-ax.grid(False)
-fig.tight_layout()
-
-buf = io.BytesIO()
-plt.savefig(buf, format='png', bbox_inches='tight', pad_inches=0, dpi=450)
-plt.close(fig)
-buf.seek(0)
-field_image = Image.open(buf)
+background_key = cache.render_key(kind='step 3 background', streamlines=streamline_key, magnets=magnets, dpi=dpi)
+with profiler.stage('background'):
+    field_image = np.asarray(Image.open(cache.file(background_key, 'background.png', render_background)))
 
 # --- Animation ---
 wire_current = 10
 wire_y = 1
-x_positions = np.linspace(x.min(), x.max(), 120)
-
-frames = []
-
-for i, wire_x in enumerate(x_positions):
-    print(f"Frame {i+1}/{len(x_positions)}")
-
-    fig, ax = plt.subplots(figsize=(12,6))
+num_frames = 120
+workers = None  # render processes; None uses every core, 1 renders in this process
+output_path = 'step 3.gif'  # .gif, .png (APNG) or .mp4 (needs ffmpeg)
+frame_store = None  # directory to keep finished frames in, so an interrupted render resumes where it stopped
+frame_range = None  # (start, stop): only render these frames into frame_store, e.g. one share per machine
+apply_overrides(globals())
+
+x_positions = np.linspace(x.min(), x.max(), num_frames)
+
+# Exact B-field at every wire position along the path, in one batch
+Bx_wire_path, By_wire_path = array_field(x_positions, wire_y, sources)
+
+# The static layers are drawn once per process; frames only redraw the wire and its force arrow
+@functools.cache
+def build_scene():
+    fig = Figure(figsize=(12,6), dpi=dpi)
+    ax = fig.subplots()
     ax.imshow(field_image, extent=(x.min(), x.max(), -yrange/2, yrange/2), aspect='auto', zorder=0)
 
     # draw magnets
@@ -110,21 +114,9 @@ for i, wire_x in enumerate(x_positions):
     # Add dashed line showing conductor path
     ax.plot(x, np.ones_like(x), 'k--', linewidth=1, zorder=3)
 
-    # Plot wire
-    ax.scatter([wire_x], [wire_y], c='orange', s=150, marker='o', zorder=4)
-
-    # Calculate B-field at wire location
-    ix = np.abs(x - wire_x).argmin()
-    iy = np.abs(y - wire_y).argmin()
-    Bx_wire = Bx_total[iy, ix]
-    By_wire = By_total[iy, ix]
-
-    # Lorentz Force: F = I * (L x B), with current into the plane (-z)
-    Fx = wire_current * By_wire
-    Fy = -wire_current * Bx_wire
-
-    # Plot force vector
-    ax.quiver(wire_x, wire_y, Fx, Fy, color='black', scale=50, scale_units='xy', angles='xy', width=0.005, zorder=5)
+    # Wire and force vector, moved every frame
+    wire = ax.scatter([x_positions[0]], [wire_y], c='orange', s=150, marker='o', zorder=4)
+    force = ax.quiver(x_positions[0], wire_y, 0, 0, color='black', scale=50, scale_units='xy', angles='xy', width=0.005, zorder=5)
 
     ax.set_xlim(x.min(), x.max())
     ax.set_ylim(-yrange/2, yrange/2)
@@ -132,14 +124,25 @@ for i, wire_x in enumerate(x_positions):
     ax.set_yticks([])
     ax.grid(False)
 
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=450)
-    plt.close(fig)
-    buf.seek(0)
-    frame = Image.open(buf)
-    frames.append(frame)
+    return BlitRenderer(fig, [wire, force]), wire, force
+
+def draw_frame(i):
+    renderer, wire, force = build_scene()
+    wire_x = x_positions[i]
+
+    # Calculate B-field at wire location
+    Bx_wire = Bx_wire_path[i]
+    By_wire = By_wire_path[i]
+
+    # Lorentz Force: F = I * (L x B), with current into the plane (-z)
+    Fx = wire_current * By_wire
+    Fy = -wire_current * Bx_wire
 
-frames = [frame.convert("RGBA") for frame in frames]
-frames = [frame.convert("P", palette=Image.ADAPTIVE) for frame in frames]
+    wire.set_offsets([[wire_x, wire_y]])
+    force.set_offsets([[wire_x, wire_y]])
+    force.set_UVC(Fx, Fy)
+    return renderer.render()
 
-frames[0].save('step 3.gif', save_all=True, append_images=frames[1:], duration=25, loop=0)
\ No newline at end of file
+render_animation(draw_frame, len(x_positions), output_path, duration=25,
+                 store_key=cache.key(kind='step 3 frames', background=background_key, wire_current=wire_current, wire_y=wire_y),
+                 frame_store=frame_store, frame_range=frame_range, workers=workers, profiler=profiler)
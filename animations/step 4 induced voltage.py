@@ -2,21 +2,19 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 from PIL import Image
-import io
-
-def monopole_field(x, y, mx, my, q):
-    r_squared = (x - mx)**2 + (y - my)**2
-    r_squared[r_squared == 0] = 1e-12
-    Bx = q * (x - mx) / r_squared
-    By = q * (y - my) / r_squared
-    return Bx, By
-
-def bar_magnet_field(x, y, x1, y1, x2, y2, strength):
-    Bx1, By1 = monopole_field(x, y, x1, y1, strength)
-    Bx2, By2 = monopole_field(x, y, x2, y2, -strength)
-    return Bx1 + Bx2, By1 + By2
-
-def render_field_image(X, Y, Bx_total, By_total, x_limits, y_limits, dpi=450):
+import functools
+from matplotlib.figure import Figure
+from magnet_field import magnet_array, magnet_sources, array_field
+from frame_render import BlitRenderer
+from frame_store import render_animation
+from field_cache import FieldCache
+from instrumentation import Profiler
+from periodic_field import array_cell, harmonic_content
+from carriage import back_emf
+from streamlines import trace_streamlines, draw_streamlines
+from script_params import apply_overrides
+
+def render_field_image(path, streamlines, x, y, Bx_total, By_total, x_limits, y_limits, dpi=450):
     x_range = x_limits[1] - x_limits[0]
     y_range = y_limits[1] - y_limits[0]
     aspect_ratio = x_range / y_range
@@ -30,14 +28,11 @@ def render_field_image(X, Y, Bx_total, By_total, x_limits, y_limits, dpi=450):
     ax.set_ylim(y_limits)
 
     magnitude = np.log(np.sqrt(Bx_total**2 + By_total**2) + 1e-9)
-    ax.streamplot(X, Y, Bx_total, By_total, color=magnitude, cmap='viridis', density=2, linewidth=1, arrowsize=0.75)
+    draw_streamlines(ax, streamlines, x, y, magnitude, cmap='viridis', linewidth=1, arrowsize=0.75)
 
     plt.subplots_adjust(left=0, right=1, top=1, bottom=0)
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight', pad_inches=0, dpi=dpi)
+    plt.savefig(path, format='png', bbox_inches='tight', pad_inches=0, dpi=dpi)
     plt.close(fig)
-    buf.seek(0)
-    return Image.open(buf)
 
 # --- Setup constants ---
 n_magnets = 8
@@ -49,6 +44,8 @@ dipole_inset = 0.2
 reverse_every_other = True
 xbrim = 3
 yrange = 6
+dpi = 450  # of the field background and the frames
+apply_overrides(globals())  # values given to tlm.py
 
 total_length = n_magnets * length + (n_magnets - 1) * gap
 center_shift = total_length / 2
@@ -57,92 +54,101 @@ x = np.linspace(-1 * xbrim - center_shift, n_magnets * (length + gap) + xbrim -
 y = np.linspace(-yrange/2, yrange/2, 200)
 X, Y = np.meshgrid(x, y)
 
-magnets = []
-Bx_total = np.zeros_like(X)
-By_total = np.zeros_like(Y)
-
-for i in range(n_magnets):
-    start_x = i * (length + gap) - center_shift
-    end_x = start_x + length
-    if reverse_every_other and i % 2 == 1:
-        north_x = end_x - dipole_inset
-        south_x = start_x + dipole_inset
-    else:
-        north_x = start_x + dipole_inset
-        south_x = end_x - dipole_inset
-    magnets.append((north_x, 0, south_x, 0))
-
-    Bx, By = bar_magnet_field(X, Y, north_x, 0, south_x, 0, strength)
-    Bx_total += Bx
-    By_total += By
+# Field and background are reused from an earlier run with the same geometry, grid and render settings
+cache = FieldCache()
+profiler = Profiler()  # TLM_PROFILE=1 prints per-stage timings, TLM_TRACE=path writes a Chrome trace
+magnets = magnet_array(n_magnets, length, gap, height, dipole_inset, reverse_every_other)
+sources = magnet_sources(magnets, strength)
+field_key = cache.key(kind='pm_field', sources=sources, x=(x[0], x[-1], len(x)), y=(y[0], y[-1], len(y)))
+with profiler.stage('field'):
+    Bx_total, By_total = cache.arrays(field_key, ('Bx', 'By'), lambda: array_field(X, Y, sources))
+
+# Streamline geometry is in data coordinates, so it is traced once for any dpi or figure size
+streamline_key = cache.key(kind='streamlines', field=field_key, density=2)
+streamline_names = ('points', 'offsets', 'arrows')
+with profiler.stage('streamlines'):
+    streamlines = dict(zip(streamline_names, cache.arrays(streamline_key, streamline_names,
+                                                          lambda: trace_streamlines(x, y, Bx_total, By_total, 2).values())))
 
 # Pre-render the field image
 x_limits = (x.min(), x.max())
 y_limits = (-yrange/2, yrange/2)
-field_image = render_field_image(X, Y, Bx_total, By_total, x_limits, y_limits)
+background_key = cache.render_key(kind='step 4 background', streamlines=streamline_key, x_limits=x_limits, y_limits=y_limits, dpi=dpi)
+with profiler.stage('background'):
+    field_image = np.asarray(Image.open(cache.file(background_key, 'background.png',
+                                                  lambda path: render_field_image(path, streamlines, x, y, Bx_total, By_total, x_limits, y_limits, dpi))))
 
 # --- Simulation parameters ---
 v_x = 2.0    # fixed scalar velocity
 L = 1.0      # conductor length
-x_positions = np.linspace(x_limits[0], x_limits[1], 240)
-emf_values = []
-
-frames = []
-
-for step, x_pos in enumerate(x_positions):
-    print(f"Step {step+1}/{len(x_positions)}")
-
-    Bx, By = 0.0, 0.0
-    for north_x, north_y, south_x, south_y in magnets:
-        Bx_m, By_m = bar_magnet_field(np.array([x_pos]), np.array([1]), north_x, north_y, south_x, south_y, strength)
-        Bx += Bx_m[0]
-        By += By_m[0]
-
-    emf = v_x * By * L
-    emf_values.append(emf)
-
-    # Render the field and conductor for every second step
-    if step % 2 == 0:
-
-        fig, axs = plt.subplots(2, 1, figsize=(12, 6))
-
-        # --- Plot field with magnets, poles, dashed line, and conductor ---
-        axs[0].imshow(field_image, extent=(*x_limits, *y_limits), aspect='auto', zorder=0)
-
-        for i, (north_x, north_y, south_x, south_y) in enumerate(magnets):
-            start_x = i * (length + gap) - center_shift
-            rect = patches.Rectangle((start_x, -height/2), length, height, linewidth=1, edgecolor='black', facecolor='grey', zorder=1)
-            axs[0].add_patch(rect)
-            axs[0].scatter([north_x, south_x], [north_y, south_y], c=['red', 'blue'], s=50, zorder=2)
-
-        axs[0].plot(x, np.ones_like(x), 'k--', label='Conductor Path', zorder=3)
-        axs[0].scatter([x_pos], [1], color='orange', s=100, label='Conductor', zorder=4)
-        axs[0].set_xlim(x_limits)
-        axs[0].set_ylim(y_limits)
-        axs[0].set_xticks([])
-        axs[0].set_yticks([])
-
-        # --- Plot EMF vs position ---
-        axs[1].plot(x_positions[:step+1], emf_values, linewidth=2, color='grey')
-        sine_wave = 12.6 * np.sin(2 * np.pi * x_positions / 4 + np.pi/2)
-        axs[1].plot(x_positions, sine_wave, label='Reference Sine Wave', linewidth=1, linestyle='dashed', color='gray')
-        axs[1].axhline(0, linewidth=0.5, linestyle='dashed', color='gray')
-        axs[1].set_xlabel('')
-        axs[1].set_ylabel('')
-        axs[1].set_xlim(x_limits)
-        axs[1].set_ylim(-15, 15)
-        axs[1].grid()
-        axs[1].set_xticks([])
-        axs[1].set_yticks([0])
-
-        buf = io.BytesIO()
-        plt.tight_layout()
-        plt.savefig(buf, format='png', dpi=450)
-        plt.close(fig)
-        buf.seek(0)
-        frames.append(Image.open(buf))
-
-frames = [frame.convert("RGBA") for frame in frames]
-frames = [frame.convert("P", palette=Image.ADAPTIVE) for frame in frames]
-
-frames[0].save('step 4.gif', save_all=True, append_images=frames[1:], duration=45, loop=0)
+num_frames = 120
+workers = None  # render processes; None uses every core, 1 renders in this process
+output_path = 'step 4.gif'  # .gif, .png (APNG) or .mp4 (needs ffmpeg)
+frame_store = None  # directory to keep finished frames in, so an interrupted render resumes where it stopped
+frame_range = None  # (start, stop): only render these frames into frame_store, e.g. one share per machine
+apply_overrides(globals())
+
+x_positions = np.linspace(x_limits[0], x_limits[1], 2 * num_frames)
+
+conductor = [(0, 1, 0, 1)]  # a single wire at y = 1, on phase A
+
+# EMF along the whole conductor path, evaluated in one batch before rendering
+with profiler.stage('emf'):
+    emf_values = back_emf(functools.partial(array_field, sources=sources), x_positions, v_x, conductor, L)[0]
+
+# Reference sine: fundamental of the EMF for the same array repeated indefinitely
+magnets_per_period = 2 if reverse_every_other else 1
+period = magnets_per_period * (length + gap)
+orders, amplitudes, phases = harmonic_content(array_cell(sources, magnets_per_period)[0], period, 1)
+sine_wave = v_x * L * amplitudes[1] * np.cos(2 * np.pi * x_positions / period + phases[1])
+
+# Render the field and conductor for every second step
+frame_steps = range(0, len(x_positions), 2)
+
+# The static layers are drawn once per process; frames only redraw the conductor and the EMF trace
+@functools.cache
+def build_scene():
+    fig = Figure(figsize=(12, 6), dpi=dpi)
+    axs = fig.subplots(2, 1)
+
+    # --- Plot field with magnets, poles, dashed line, and conductor ---
+    axs[0].imshow(field_image, extent=(*x_limits, *y_limits), aspect='auto', zorder=0)
+
+    for (start_x, start_y, width, height, north_x, north_y, south_x, south_y) in magnets:
+        rect = patches.Rectangle((start_x, -height/2), width, height, linewidth=1, edgecolor='black', facecolor='grey', zorder=1)
+        axs[0].add_patch(rect)
+        axs[0].scatter([north_x, south_x], [north_y, south_y], c=['red', 'blue'], s=50, zorder=2)
+
+    axs[0].plot(x, np.ones_like(x), 'k--', label='Conductor Path', zorder=3)
+    conductor = axs[0].scatter([x_positions[0]], [1], color='orange', s=100, label='Conductor', zorder=4)
+    axs[0].set_xlim(x_limits)
+    axs[0].set_ylim(y_limits)
+    axs[0].set_xticks([])
+    axs[0].set_yticks([])
+
+    # --- Plot EMF vs position ---
+    emf_trace, = axs[1].plot(x_positions[:1], emf_values[:1], linewidth=2, color='grey')
+    axs[1].plot(x_positions, sine_wave, label='Reference Sine Wave', linewidth=1, linestyle='dashed', color='gray')
+    axs[1].axhline(0, linewidth=0.5, linestyle='dashed', color='gray')
+    axs[1].set_xlabel('')
+    axs[1].set_ylabel('')
+    axs[1].set_xlim(x_limits)
+    axs[1].set_ylim(-15, 15)
+    axs[1].grid()
+    axs[1].set_xticks([])
+    axs[1].set_yticks([0])
+
+    fig.tight_layout()
+    return BlitRenderer(fig, [conductor, emf_trace]), conductor, emf_trace
+
+def draw_frame(i):
+    renderer, conductor, emf_trace = build_scene()
+    step = frame_steps[i]
+
+    conductor.set_offsets([[x_positions[step], 1]])
+    emf_trace.set_data(x_positions[:step+1], emf_values[:step+1])
+    return renderer.render()
+
+render_animation(draw_frame, len(frame_steps), output_path, duration=45,
+                 store_key=cache.key(kind='step 4 frames', background=background_key, sources=sources, magnets=magnets, v_x=v_x, L=L),
+                 frame_store=frame_store, frame_range=frame_range, workers=workers, profiler=profiler)
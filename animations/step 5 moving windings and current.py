@@ -2,27 +2,16 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 from PIL import Image
-import io
-
-def monopole_field(x, y, mx, my, q):
-    r_squared = (x - mx)**2 + (y - my)**2
-    r_squared[r_squared == 0] = 1e-12
-    Bx = q * (x - mx) / r_squared
-    By = q * (y - my) / r_squared
-    return Bx, By
-
-def bar_magnet_field(x, y, x1, y1, x2, y2, strength):
-    Bx1, By1 = monopole_field(x, y, x1, y1, strength)
-    Bx2, By2 = monopole_field(x, y, x2, y2, -strength)
-    return Bx1 + Bx2, By1 + By2
-
-def current_carrying_wire_field(x, y, x0, y0, I):
-    mu0 = 4 * np.pi * 1e-7
-    r_squared = (x - x0)**2 + (y - y0)**2
-    r_squared[r_squared == 0] = 1e-12
-    Bx = -mu0 * I * (y - y0) / (2 * np.pi * r_squared)
-    By = mu0 * I * (x - x0) / (2 * np.pi * r_squared)
-    return Bx, By
+import functools
+from matplotlib.figure import Figure
+from magnet_field import magnet_array, magnet_sources, array_field
+from frame_render import BlitRenderer
+from frame_store import render_animation
+from field_cache import FieldCache
+from instrumentation import Profiler
+from carriage import step5_winding, wire_forces
+from streamlines import trace_streamlines, draw_streamlines
+from script_params import apply_overrides
 
 # Parameters
 n_magnets = 8
@@ -35,6 +24,8 @@ reverse_every_other = True
 xbrim = 3
 yrange = 8
 field_density = 2
+dpi = 600  # of the field background and the frames
+apply_overrides(globals())  # values given to tlm.py
 
 total_length = n_magnets * length + (n_magnets - 1) * gap
 center_shift = total_length / 2
@@ -43,107 +34,75 @@ x = np.linspace(-1*xbrim - center_shift, n_magnets * (length + gap) + xbrim - ce
 y = np.linspace(-1*yrange/2, yrange/2, int(yrange*40))
 X, Y = np.meshgrid(x, y)
 
-magnets = []
-for i in range(n_magnets):
-    start_x = i * (length + gap) - center_shift
-    end_x = start_x + length
-    if reverse_every_other and i % 2 == 1:
-        north_x = end_x - dipole_inset
-        south_x = start_x + dipole_inset
-    else:
-        north_x = start_x + dipole_inset
-        south_x = end_x - dipole_inset
-    magnets.append((start_x, 0, length, height, north_x, 0, south_x, 0))
-
-# Precompute and save static PM field plot
-Bx_pm_total = np.zeros_like(X)
-By_pm_total = np.zeros_like(Y)
-
-for (_, _, _, _, north_x, north_y, south_x, south_y) in magnets:
-    Bx, By = bar_magnet_field(X, Y, north_x, north_y, south_x, south_y, strength)
-    Bx_pm_total += Bx
-    By_pm_total += By
-
-fig, ax = plt.subplots()
-ax.axis('off')  # Hide axes
-ax.set_xlim(x.min(), x.max())
-ax.set_ylim(-yrange/2, yrange/2)
-ax.set_aspect('equal')
-
-ax.streamplot(X, Y, Bx_pm_total, By_pm_total, color=np.log(np.sqrt(Bx_pm_total**2 + By_pm_total**2)), cmap='viridis', density=field_density, linewidth=1, arrowsize=0.75, zorder=1)
-
-for (start_x, start_y, width, height, north_x, north_y, south_x, south_y) in magnets:
-    rect = patches.Rectangle((start_x, -height/2), width, height, linewidth=1, edgecolor='black', facecolor='grey', zorder=2)
-    ax.add_patch(rect)
-    ax.scatter([north_x, south_x], [north_y, south_y], c=['red', 'blue'], s=15, zorder=3)
-
-fig.savefig('static_pm_field.png', bbox_inches='tight', pad_inches=0, dpi=600)
-plt.close(fig)
+magnets = magnet_array(n_magnets, length, gap, height, dipole_inset, reverse_every_other)
+
+# Precompute the PM field and its static plot, or reuse them from an earlier run with the same parameters
+cache = FieldCache()
+profiler = Profiler()  # TLM_PROFILE=1 prints per-stage timings, TLM_TRACE=path writes a Chrome trace
+sources = magnet_sources(magnets, strength)
+field_key = cache.key(kind='pm_field', sources=sources, x=(x[0], x[-1], len(x)), y=(y[0], y[-1], len(y)))
+with profiler.stage('field'):
+    Bx_pm_total, By_pm_total = cache.arrays(field_key, ('Bx', 'By'), lambda: array_field(X, Y, sources))
+field = functools.partial(array_field, sources=sources)
+
+# Streamline geometry is in data coordinates, so it is traced once for any dpi or figure size
+streamline_key = cache.key(kind='streamlines', field=field_key, density=field_density)
+streamline_names = ('points', 'offsets', 'arrows')
+with profiler.stage('streamlines'):
+    streamlines = dict(zip(streamline_names, cache.arrays(streamline_key, streamline_names,
+                                                          lambda: trace_streamlines(x, y, Bx_pm_total, By_pm_total, field_density).values())))
+
+def render_static_pm_field(path):
+    fig, ax = plt.subplots()
+    ax.axis('off')  # Hide axes
+    ax.set_xlim(x.min(), x.max())
+    ax.set_ylim(-yrange/2, yrange/2)
+    ax.set_aspect('equal')
 
-# Animation loop with PM field image as background
-num_frames = 200
-frames = []
-static_pm_image = Image.open('static_pm_field.png')
+    draw_streamlines(ax, streamlines, x, y, np.log(np.sqrt(Bx_pm_total**2 + By_pm_total**2)), cmap='viridis', linewidth=1, arrowsize=0.75, zorder=1)
 
-for frame_idx in range(num_frames):
-    print(f'Processing frame {frame_idx + 1}/{num_frames}')
-    t = frame_idx / num_frames
+    for (start_x, start_y, width, height, north_x, north_y, south_x, south_y) in magnets:
+        rect = patches.Rectangle((start_x, -height/2), width, height, linewidth=1, edgecolor='black', facecolor='grey', zorder=2)
+        ax.add_patch(rect)
+        ax.scatter([north_x, south_x], [north_y, south_y], c=['red', 'blue'], s=15, zorder=3)
 
-    theta = 4 * np.pi * t
-    I = 10
-    IA = I * np.sin(theta - np.pi/3)
-    IB = I * np.sin(theta)
-    IC = I * np.sin(theta + np.pi/3)
-
-    wires = [
-        (-5.666667 + 8*t, 1, IA),
-        (-5.000000 + 8*t, 1, IB),
-        (-4.333333 + 8*t, 1, IC),
-        (-3.666667 + 8*t, 1, -IA),
-        (-3.000000 + 8*t, 1, -IB),
-        (-2.333333 + 8*t, 1, -IC)
-    ]
+    fig.savefig(path, format='png', bbox_inches='tight', pad_inches=0, dpi=dpi)
+    plt.close(fig)
 
-    fig, ax = plt.subplots()
+background_key = cache.render_key(kind='step 5 background', streamlines=streamline_key, magnets=magnets, dpi=dpi)
+with profiler.stage('background'):
+    static_pm_path = cache.file(background_key, 'static_pm_field.png', render_static_pm_field)
+
+# Animation loop with PM field image as background
+num_frames = 200
+workers = None  # render processes; None uses every core, 1 renders in this process
+output_path = 'step 5.gif'  # .gif, .png (APNG) or .mp4 (needs ffmpeg)
+frame_store = None  # directory to keep finished frames in, so an interrupted render resumes where it stopped
+frame_range = None  # (start, stop): only render these frames into frame_store, e.g. one share per machine
+apply_overrides(globals())
+
+static_pm_image = np.asarray(Image.open(static_pm_path))
+
+# The static layers are drawn once per process; frames only redraw the carriage, wires and force arrows
+@functools.cache
+def build_scene():
+    fig = Figure(dpi=dpi)
+    ax = fig.subplots()
     ax.imshow(static_pm_image, extent=(x.min(), x.max(), -yrange/2, yrange/2), aspect='auto', zorder=0)
 
     # --- Add rectangle around the conductors ---
-    rect_x = -4 + 8*t - 2
     rect_y = -1.333333
     rect_width = 4
     rect_height = 2 * 1.333333
-    carriage_rect = patches.Rectangle((rect_x, rect_y), rect_width, rect_height, linewidth=1, edgecolor='black', facecolor='none', zorder=3)
+    carriage_rect = patches.Rectangle((-6, rect_y), rect_width, rect_height, linewidth=1, edgecolor='black', facecolor='none', zorder=3)
     ax.add_patch(carriage_rect)
 
-    total_Fx = 0
-    total_Fy = 0
-
-    for wire_x, wire_y, current_I in wires:
-        ix = np.abs(x - wire_x).argmin()
-        iy = np.abs(y - wire_y).argmin()
-        B_at_wire_x = Bx_pm_total[iy, ix]
-        B_at_wire_y = By_pm_total[iy, ix]
-        Fx = current_I * B_at_wire_y
-        Fy = -current_I * B_at_wire_x
-
-        ax.scatter([wire_x], [wire_y], c='orange', s=40, marker='o', zorder=4)
-        ax.quiver(wire_x, wire_y, Fx, Fy, color='black', angles='xy', scale_units='xy', scale=40, width=0.005, zorder=5)
-
-        return_wire_y = -wire_y
-        ix_ret = np.abs(x - wire_x).argmin()
-        iy_ret = np.abs(y - return_wire_y).argmin()
-        B_at_return_x = Bx_pm_total[iy_ret, ix_ret]
-        B_at_return_y = By_pm_total[iy_ret, ix_ret]
-        Fx_ret = -current_I * B_at_return_y
-        Fy_ret = current_I * B_at_return_x
-
-        ax.scatter([wire_x], [return_wire_y], c='orange', s=40, marker='o', zorder=4)
-        ax.quiver(wire_x, return_wire_y, Fx_ret, Fy_ret, color='black', angles='xy', scale_units='xy', scale=50, width=0.005, zorder=5)
-
-        total_Fx += Fx + Fx_ret
-        total_Fy += Fy + Fy_ret
-
-    ax.quiver(-4 + 8*t, 0, total_Fx, total_Fy, color='black', angles='xy', scale_units='xy', scale=40, width=0.007, zorder=6)
+    # Conductors with their forces, and the return wires with theirs
+    no_wires = np.zeros(6)
+    wire_dots = ax.scatter(np.zeros(12), np.zeros(12), c='orange', s=40, marker='o', zorder=4)
+    wire_arrows = ax.quiver(no_wires, no_wires, no_wires, no_wires, color='black', angles='xy', scale_units='xy', scale=40, width=0.005, zorder=5)
+    return_arrows = ax.quiver(no_wires, no_wires, no_wires, no_wires, color='black', angles='xy', scale_units='xy', scale=50, width=0.005, zorder=5)
+    total_arrow = ax.quiver(0, 0, 0, 0, color='black', angles='xy', scale_units='xy', scale=40, width=0.007, zorder=6)
 
     ax.set_xlabel('')
     ax.set_ylabel('')
@@ -153,10 +112,32 @@ for frame_idx in range(num_frames):
     ax.set_ylim(-yrange/2, yrange/2)
     ax.set_aspect('equal')
 
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=600)
-    plt.close(fig)
-    buf.seek(0)
-    frames.append(Image.open(buf))
+    renderer = BlitRenderer(fig, [carriage_rect, wire_dots, wire_arrows, return_arrows, total_arrow])
+    return renderer, carriage_rect, wire_dots, wire_arrows, return_arrows, total_arrow
+
+def draw_frame(frame_idx):
+    renderer, carriage_rect, wire_dots, wire_arrows, return_arrows, total_arrow = build_scene()
+    t = frame_idx / num_frames
+
+    # Carriage centre and electrical angle; the winding fixes the wires relative to the centre
+    position = -4 + 8*t
+    theta = 4 * np.pi * t
+    I = 10
 
-frames[0].save('step 5.gif', save_all=True, append_images=frames[1:], duration=60, loop=0)
\ No newline at end of file
+    # Exact B-field and Lorentz force at every conductor and its return wire, in one batch
+    wire_x, wire_y, currents, Fx, Fy = wire_forces(field, position, theta, I, step5_winding)
+    top = wire_y > 0
+
+    carriage_rect.set_x(position - 2)
+    wire_dots.set_offsets(np.column_stack([wire_x, wire_y]))
+    wire_arrows.set_offsets(np.column_stack([wire_x[top], wire_y[top]]))
+    wire_arrows.set_UVC(Fx[top], Fy[top])
+    return_arrows.set_offsets(np.column_stack([wire_x[~top], wire_y[~top]]))
+    return_arrows.set_UVC(Fx[~top], Fy[~top])
+    total_arrow.set_offsets([[position, 0]])
+    total_arrow.set_UVC(Fx.sum(), Fy.sum())
+    return renderer.render()
+
+render_animation(draw_frame, num_frames, output_path, duration=60,
+                 store_key=cache.key(kind='step 5 frames', background=background_key, sources=sources),
+                 frame_store=frame_store, frame_range=frame_range, workers=workers, profiler=profiler)
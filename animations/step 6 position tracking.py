@@ -0,0 +1,82 @@
+import numpy as np
+import matplotlib.pyplot as plt
+import functools
+import os
+from magnet_field import magnet_array, magnet_sources, array_field
+from field_cache import FieldCache
+from carriage import thrust_metrics
+from force_table import build_force_table, ForceTable
+from motion import simulate, reciprocating_profile
+from script_params import apply_overrides
+
+# Parameters
+n_magnets = 8
+strength = 5
+gap = 0
+length = 2
+height = 0.5
+dipole_inset = 0.2
+reverse_every_other = True
+
+# Carriage and controller
+mass = 1.0
+damping = 0.5  # viscous friction
+coulomb = 0.5  # dry friction
+max_current = 20
+stroke = 4
+move_time = 0.5
+dwell_time = 0.2
+kp = np.array([50, 100, 200, 400, 800])[:, None]  # every combination of kp and kd is simulated in one batch
+kd = np.array([5, 10, 20, 40])[None, :]
+t_end = 2.5
+dt = 1e-3
+output_path = None  # save the figure here instead of showing it
+apply_overrides(globals())  # values given to tlm.py
+
+magnets = magnet_array(n_magnets, length, gap, height, dipole_inset, reverse_every_other)
+sources = magnet_sources(magnets, strength)
+field = functools.partial(array_field, sources=sources)
+period = 2 * (length + gap)
+metrics = thrust_metrics(field, np.linspace(-period/2, period/2, 400, endpoint=False), period)
+
+# Tabulate the thrust once, or reuse the table from an earlier run with the same magnets
+cache = FieldCache()
+
+def write_force_table(path):
+    # The .npy is written next to the metadata, which the cache moves into place last
+    base = os.path.join(os.path.dirname(path), 'force_table')
+    build_force_table(base, field, np.linspace(-8, 8, 8001))
+    os.replace(base + '.json', path)
+
+table_key = cache.key(kind='force_table', sources=sources, start=-8, stop=8, count=8001)
+table_path = cache.file(table_key, 'force_table.json', write_force_table)
+table = ForceTable(table_path[:-len('.json')])
+
+def reference(t):
+    position, velocity = reciprocating_profile(t, stroke, move_time, dwell_time)
+    return position - stroke/2, velocity
+
+result = simulate(table.force_from_angle, reference, t_end, dt, mass, period, kp, kd=kd,
+                  commutation_angle=metrics['commutation_angle'], max_current=max_current,
+                  damping=damping, coulomb=coulomb, position=-stroke/2)
+
+# Plot the gain set with the smallest RMS tracking error
+rms_error = np.sqrt(np.mean((result['position'] - result['reference_position'])**2, axis=0))
+best = np.unravel_index(np.argmin(rms_error), rms_error.shape)
+print(f"Best gains: kp = {kp[best[0], 0]}, kd = {kd[0, best[1]]}, RMS error = {rms_error[best]:.4f}")
+
+fig, ax = plt.subplots(figsize=(12, 6))
+ax.plot(result['t'], result['position'][(slice(None),) + best], color='red', label='Actual position')
+ax.plot(result['t'], result['reference_position'][(slice(None),) + best], '--', color='orange', label='Setpoint position')
+ax.set_xlabel('Time')
+ax.set_ylabel('Position')
+ax_velocity = ax.twinx()
+ax_velocity.plot(result['t'], result['velocity'][(slice(None),) + best], color='blue', label='Actual velocity')
+ax_velocity.plot(result['t'], result['reference_velocity'][(slice(None),) + best], '--', color='green', label='Setpoint velocity')
+ax_velocity.set_ylabel('Velocity')
+lines = ax.get_lines() + ax_velocity.get_lines()
+ax.legend(lines, [line.get_label() for line in lines], loc='upper left')
+if output_path:
+    fig.savefig(output_path)
+else:
+    plt.show()
@@ -0,0 +1,160 @@
+import functools
+import itertools
+import json
+import multiprocessing
+import os
+import numpy as np
+from magnet_field import magnet_array, magnet_sources, array_field
+from carriage import make_winding, thrust_metrics, back_emf, emf_harmonics
+
+# Parameter sweeps and a simple optimiser over the motor geometry.
+#
+# A design is the set of module constants of the step scripts plus the
+# winding pitch and height (see carriage.make_winding). sweep() evaluates
+# every combination of the given parameter values across a process pool and
+# appends the results to a columnar .npz file (one array per parameter and
+# metric, plus the 'index' of each row in the grid) every `flush_every`
+# designs, so an interrupted sweep picks up where it stopped when run again.
+
+default_design = {
+    'n_magnets': 8,
+    'strength': 5,
+    'gap': 0,
+    'length': 2,
+    'height': 0.5,
+    'dipole_inset': 0.2,
+    'coil_pitch': 2/3,
+    'coil_y': 1,
+}
+
+metric_names = ('force_constant', 'commutation_angle', 'thrust_ripple', 'emf_constant', 'emf_thd', 'emf_h3', 'emf_h5')
+
+def design_field(design, model='planar'):
+    """The field callable of `design`, planar (as in the scripts) or 'axisymmetric' (ring_field)."""
+    magnets = magnet_array(int(design['n_magnets']), design['length'], design['gap'], design['height'], design['dipole_inset'])
+    if model == 'axisymmetric':
+        from ring_field import RingField, magnet_rings
+        return RingField(magnet_rings(magnets, design['strength'], n_rings=3))
+    return functools.partial(array_field, sources=magnet_sources(magnets, design['strength']))
+
+def evaluate_design(design, model='planar', n_positions=256):
+    """Thrust and back-EMF metrics of one design, over one magnetic period at the array centre.
+
+    The EMF metrics are for phase A at unit velocity: the amplitude of its
+    fundamental, its total harmonic distortion (harmonics 2-15) and its 3rd
+    and 5th harmonics relative to the fundamental.
+    """
+    design = {**default_design, **design}
+    field = design_field(design, model)
+    winding = make_winding(design['coil_pitch'], design['coil_y'])
+    period = 2 * (design['length'] + design['gap'])
+    positions = np.linspace(-period / 2, period / 2, n_positions, endpoint=False)
+
+    metrics = thrust_metrics(field, positions, period, winding=winding)
+    emf = back_emf(field, positions, 1.0, winding)[0]
+    return {
+        'force_constant': metrics['force_constant'],
+        'commutation_angle': metrics['commutation_angle'],
+        'thrust_ripple': metrics['thrust_ripple'],
+        **emf_harmonics(emf),
+    }
+
+def _evaluate_row(job):
+    index, design, model = job
+    return index, evaluate_design(design, model)
+
+def _save(path, columns, grid):
+    tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez(tmp_path, grid=np.array(grid), **{name: np.array(values) for name, values in columns.items()})
+    os.replace(tmp_path, path)
+
+def load_results(path):
+    """The columns of a sweep file as a dict of arrays, in grid order."""
+    with np.load(path) as data:
+        columns = {name: data[name] for name in data.files if name != 'grid'}
+    order = np.argsort(columns['index'])
+    return {name: values[order] for name, values in columns.items()}
+
+def sweep(ranges, path, model='planar', workers=None, flush_every=16, fixed=None):
+    """Evaluate every combination of the parameter values in `ranges` and store them in `path`.
+
+    `ranges` maps parameter names of default_design to sequences of values;
+    `fixed` overrides other defaults for the whole sweep. Designs already in
+    an existing `path` from the same sweep are skipped. Returns load_results(path).
+    """
+    names = list(ranges)
+    unknown = set(names) | set(fixed or ())
+    unknown -= set(default_design)
+    if unknown:
+        raise ValueError(f"unknown design parameters: {', '.join(sorted(unknown))}")
+    grid = json.dumps({'ranges': {name: [float(v) for v in values] for name, values in ranges.items()},
+                       'fixed': fixed or {}, 'model': model}, sort_keys=True)
+    combinations = list(itertools.product(*(ranges[name] for name in names)))
+
+    columns = {name: [] for name in ('index', *names, *metric_names)}
+    if os.path.exists(path):
+        with np.load(path) as data:
+            if str(data['grid']) != grid:
+                raise ValueError(f"{path} holds a different sweep; remove it or choose another path")
+            for name in columns:
+                columns[name] = list(data[name])
+    done = set(int(i) for i in columns['index'])
+
+    base = {**default_design, **(fixed or {})}
+    jobs = [(i, {**base, **dict(zip(names, values))}, model) for i, values in enumerate(combinations) if i not in done]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, max(len(jobs), 1))
+    if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        pool = None
+        results = map(_evaluate_row, jobs)
+    else:
+        pool = multiprocessing.get_context('fork').Pool(workers)
+        results = pool.imap_unordered(_evaluate_row, jobs)
+
+    try:
+        for count, (index, metrics) in enumerate(results, 1):
+            columns['index'].append(index)
+            for name, value in zip(names, combinations[index]):
+                columns[name].append(value)
+            for name in metric_names:
+                columns[name].append(metrics[name])
+            if count % flush_every == 0:
+                _save(path, columns, grid)
+        _save(path, columns, grid)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return load_results(path)
+
+def refine(bounds, objective, path, points=5, rounds=4, model='planar', workers=None, fixed=None):
+    """Maximise objective(results) over continuous design parameters by repeated grid sweeps.
+
+    `bounds` maps parameter names to (low, high). Each round sweeps `points`
+    values per parameter, plus those of the best design so far, then halves
+    the box around that best design, keeping it inside the box; round r is
+    stored in f'{path}.{r}.npz', so an interrupted search resumes too.
+    `objective` gets the columns returned by sweep and returns a score per
+    design, e.g. lambda r: r['force_constant'] * (1 - 10 * r['thrust_ripple']).
+    Returns (best design over all rounds, its metrics).
+    """
+    box = dict(bounds)
+    best_score, best, metrics = -np.inf, None, None
+    for r in range(rounds):
+        ranges = {name: np.linspace(low, high, points) for name, (low, high) in box.items()}
+        if best is not None:
+            # The best design so far is evaluated again, so no round can lose it
+            ranges = {name: np.union1d(values, [best[name]]) for name, values in ranges.items()}
+        results = sweep(ranges, f'{path}.{r}.npz', model, workers, fixed=fixed)
+        scores = objective(results)
+        i = int(np.nanargmax(scores))
+        if scores[i] > best_score:
+            best_score = scores[i]
+            best = {name: float(results[name][i]) for name in box}
+            metrics = {name: float(results[name][i]) for name in metric_names}
+        for name, (low, high) in bounds.items():
+            half = (box[name][1] - box[name][0]) / 4
+            centre = np.clip(best[name], low + half, high - half)
+            box[name] = (centre - half, centre + half)
+    return {**default_design, **(fixed or {}), **best}, metrics
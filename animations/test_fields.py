@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+import field_backends
+from magnet_field import magnet_array, magnet_sources, array_field, current_carrying_wire_field
+
+# Agreement of the field backends and solvers with direct float64 summation
+# in NumPy. Run with python -m pytest from this directory.
+
+def _array(n_magnets):
+    return magnet_sources(magnet_array(n_magnets, 2, 0, 0.5, 0.2), 5)
+
+def _grid(sources, nx, ny):
+    x_max = np.abs(sources[:, 0]).max() + 3
+    return np.meshgrid(np.linspace(-x_max, x_max, nx), np.linspace(-4, 4, ny))
+
+def _assert_close(field, reference, tolerance):
+    # Both components within `tolerance` of the peak reference field
+    peak = np.hypot(*reference).max()
+    for B, B_ref in zip(field, reference):
+        np.testing.assert_allclose(B, B_ref, rtol=0, atol=tolerance * peak)
+
+@pytest.fixture
+def backend():
+    previous = field_backends.get_backend()
+    yield field_backends.set_backend
+    field_backends.set_backend(previous)
+
+@pytest.mark.parametrize('name', field_backends.available_backends())
+@pytest.mark.parametrize('n_magnets, nx, ny', [(8, 275, 200), (64, 275, 200), (64, 140, 101), (1024, 140, 101)])
+def test_backend_matches_numpy(backend, name, n_magnets, nx, ny):
+    sources = _array(n_magnets)
+    X, Y = _grid(sources, nx, ny)
+    reference = array_field(X, Y, sources)
+    backend(name)
+    _assert_close(array_field(X, Y, sources), reference, 1e-9)
+    _assert_close(array_field(X, Y, sources, dtype=np.float32), reference, 1e-5)
+
+@pytest.mark.parametrize('name', field_backends.available_backends())
+def test_backend_skips_coincident_source(backend, name):
+    sources = _array(2)
+    x, y = np.r_[sources[:, 0], 0.3], np.r_[sources[:, 1], 0.7]
+    reference = array_field(x, y, sources)
+    backend(name)
+    field = array_field(x, y, sources)
+    assert np.isfinite(field).all()
+    _assert_close(field, reference, 1e-12)
+
+@pytest.mark.parametrize('n_magnets', [9, 256])
+def test_periodic_solver(n_magnets):
+    from periodic_field import periodic_array_field
+    sources = _array(n_magnets)
+    X, Y = _grid(sources, 275, 200)
+    _assert_close(periodic_array_field(X, Y, sources), array_field(X, Y, sources), 1e-9)
+
+def test_periodic_solver_rejects_irregular_array():
+    from periodic_field import periodic_array_field
+    sources = _array(8)
+    sources[5, 0] += 0.1
+    with pytest.raises(ValueError):
+        periodic_array_field(0.0, 1.0, sources)
+
+def test_tree_solver():
+    from tree_field import tree_field
+    sources = _array(2048)
+    X, Y = _grid(sources, 275, 200)
+    _assert_close(tree_field(X, Y, sources), array_field(X, Y, sources), 1e-6)
+
+def test_winding_basis():
+    from carriage import step5_winding, winding_arrays, phase_currents
+    from winding_field import WindingFieldBasis
+    sources = _array(8)
+    x, y = np.linspace(-11, 11, 440), np.linspace(-4, 4, 320)
+    X, Y = np.meshgrid(x, y)
+    Bx_pm, By_pm = array_field(X, Y, sources)
+    basis = WindingFieldBasis(x, y, Bx_pm, By_pm, (-4, 4))
+    currents = phase_currents(0.3, 10)
+    offsets, ys, phases, signs = winding_arrays(step5_winding)
+
+    for position in np.linspace(-4, 4, 7):
+        at = basis.grid_position(position)
+        assert abs(at - position) <= (x[1] - x[0]) / 2 + 1e-12
+        Bx, By = Bx_pm.copy(), By_pm.copy()
+        for offset, wire_y, phase, sign in zip(offsets, ys, phases, signs):
+            Bx_wire, By_wire = current_carrying_wire_field(X, Y, at + offset, wire_y, sign * currents[phase])
+            Bx += Bx_wire
+            By += By_wire
+        _assert_close(basis.field(position, currents), (Bx, By), 1e-9)
+
+def test_periodic_solver_skips_coincident_source():
+    from periodic_field import periodic_array_field
+    sources = _array(9)
+    x, y = np.r_[sources[:, 0], 0.3], np.r_[sources[:, 1], 0.7]
+    with np.errstate(all='raise'):
+        field = periodic_array_field(x, y, sources)
+    _assert_close(field, array_field(x, y, sources), 1e-9)
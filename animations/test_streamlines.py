@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+from magnet_field import magnet_array, magnet_sources, array_field
+from streamlines import trace_streamlines
+
+@pytest.mark.parametrize('nx, ny', [(551, 401), (441, 321)])
+def test_zero_field_stalls_line(nx, ny):
+    # On these odd grids the field of two magnets is exactly zero at grid points the lines reach
+    sources = magnet_sources(magnet_array(2, 2, 0, 0.5, 0.2), 5)
+    x, y = np.linspace(-5, 5, nx), np.linspace(-4, 4, ny)
+    X, Y = np.meshgrid(x, y)
+    lines = trace_streamlines(x, y, *array_field(X, Y, sources), density=2.5)
+    points = lines['points']
+    assert len(lines['offsets']) > 1
+    assert np.isfinite(points).all()
+    assert (points[:, 0] >= x[0]).all() and (points[:, 0] <= x[-1]).all()
+    assert (points[:, 1] >= y[0]).all() and (points[:, 1] <= y[-1]).all()
@@ -0,0 +1,296 @@
+import argparse
+import glob
+import json
+import os
+import runpy
+import sys
+import numpy as np
+from script_params import overrides, script_parameters
+
+# Command-line entry point for batch runs.
+#
+#     python tlm.py run 5 -p design.json -o out/step5.mp4 --dpi 200 --frames 60
+#     python tlm.py run 5 --store /shared/step5 --range 0 100     # on one machine,
+#     python tlm.py run 5 --store /shared/step5 --range 100 200   # on another,
+#     python tlm.py run 5 --store /shared/step5                   # then encode
+#     python tlm.py fields -p design.json -o field.npz
+#     python tlm.py forces -p design.json -o forces.npz --positions -2 2 400
+#     python tlm.py emf -p design.json -o emf.npz --velocity 2
+#     python tlm.py tolerance -p design.json --samples 5000 --strength-tolerance 0.03
+#
+# `run` executes a step script with the Agg backend, after replacing its
+# parameters by the values of the parameter file (a JSON object, e.g.
+# {"n_magnets": 12, "gap": 0.1}; lists become arrays) and of --set
+# name=value options. Scripts that show a figure save it instead.
+#
+# `fields`, `forces` and `emf` compute the magnet field on the grid of the
+# step scripts, the force per ampere of every phase of the step 5 carriage
+# and its back-EMF, and `tolerance` the spread of the thrust and EMF
+# metrics under magnet tolerances (see tolerance.py). Each writes an .npz
+# file. They never import matplotlib, PIL or imageio, so they start quickly
+# on cluster nodes.
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Parameters of the compute-only commands, with the values of the step scripts
+compute_defaults = {
+    'n_magnets': 8,
+    'strength': 5,
+    'gap': 0,
+    'length': 2,
+    'height': 0.5,
+    'dipole_inset': 0.2,
+    'reverse_every_other': True,
+    'xbrim': 3,
+    'yrange': 8,
+    'coil_pitch': 2/3,
+    'coil_y': 1,
+}
+
+def _value(value):
+    return np.asarray(value) if isinstance(value, list) else value
+
+def load_parameters(path=None, settings=()):
+    """Parameters from a JSON file and from 'name=value' strings (values parsed as JSON, else kept as text)."""
+    params = {}
+    if path:
+        with open(path) as f:
+            params.update(json.load(f))
+    for setting in settings:
+        name, sep, text = setting.partition('=')
+        if not sep:
+            raise ValueError(f"expected name=value, got {setting!r}")
+        try:
+            params[name.strip()] = json.loads(text)
+        except json.JSONDecodeError:
+            params[name.strip()] = text
+    return {name: _value(value) for name, value in params.items()}
+
+def step_script(step):
+    """Path of the script of step `step`."""
+    paths = glob.glob(os.path.join(glob.escape(script_dir), f'step {step} *.py'))
+    if len(paths) != 1:
+        raise ValueError(f"no step {step} script in {script_dir}")
+    return paths[0]
+
+def run_step(step, params):
+    """Run step script `step` headless with its parameters replaced by `params`."""
+    os.environ['MPLBACKEND'] = 'Agg'
+    path = step_script(step)
+    unknown = set(params) - script_parameters(path)
+    if unknown:
+        raise ValueError(f"step {step} has no parameter {', '.join(sorted(unknown))}")
+
+    overrides.clear()
+    overrides.update(params)
+    try:
+        namespace = runpy.run_path(path, run_name='__main__')
+    finally:
+        overrides.clear()
+
+    if 'output_path' in namespace and namespace['output_path'] is None:
+        # A figure the script would have shown on screen
+        import matplotlib.pyplot as plt
+        output_path = os.path.splitext(os.path.basename(path))[0] + '.png'
+        plt.savefig(output_path)
+        print(f"Saved {output_path}")
+
+def check_store(directory, n_frames=None, frame_range=None):
+    """Raise ValueError if the frame store in `directory` cannot take a render of `n_frames` frames.
+
+    Only what is known before the script runs is checked; the script
+    itself refuses a store whose render settings differ.
+    """
+    from frame_store import read_manifest
+
+    if os.path.exists(directory) and not os.path.isdir(directory):
+        raise ValueError(f"frame store {directory} is not a directory")
+    manifest = read_manifest(directory)
+    if manifest is not None:
+        if n_frames is not None and manifest['n_frames'] != n_frames:
+            raise ValueError(f"{directory} holds a render of {manifest['n_frames']} frames, not {n_frames}; "
+                             "remove it or choose another directory")
+        n_frames = manifest['n_frames']
+    if frame_range is not None and n_frames is not None and not 0 <= frame_range[0] <= frame_range[1] <= n_frames:
+        raise ValueError(f"frame range {frame_range[0]} {frame_range[1]} is outside the {n_frames} frames of {directory}")
+
+def compute_design(params):
+    """The magnets, field callable and winding of the compute-only commands."""
+    from magnet_field import magnet_array
+    from carriage import make_winding
+
+    unknown = set(params) - set(compute_defaults)
+    if unknown:
+        raise ValueError(f"unknown parameters: {', '.join(sorted(unknown))}")
+    design = {**compute_defaults, **params}
+    magnets = magnet_array(int(design['n_magnets']), design['length'], design['gap'], design['height'],
+                           design['dipole_inset'], design['reverse_every_other'])
+    return design, magnets, make_winding(design['coil_pitch'], design['coil_y'])
+
+def _sources(design, magnets, model):
+    if model == 'axisymmetric':
+        from ring_field import magnet_rings
+        return magnet_rings(magnets, design['strength'], n_rings=3)
+    from magnet_field import magnet_sources
+    return magnet_sources(magnets, design['strength'])
+
+def _field(sources, model, solver='direct'):
+    if model == 'axisymmetric':
+        from ring_field import RingField
+        return RingField(sources)
+    from magnet_field import field_solver
+    return field_solver(sources, solver)
+
+def _positions(design, positions):
+    if positions is None:
+        period = 2 * (design['length'] + design['gap'])
+        return np.linspace(-period / 2, period / 2, 400, endpoint=False)
+    start, stop, count = positions
+    return np.linspace(start, stop, int(count))
+
+def compute_fields(params, output, resolution=40, model='planar', solver='direct'):
+    """Field of the magnets on the grid of the step scripts, cached like theirs."""
+    from field_cache import FieldCache
+
+    design, magnets, _ = compute_design(params)
+    n_magnets, length, gap = int(design['n_magnets']), design['length'], design['gap']
+    xbrim, yrange = design['xbrim'], design['yrange']
+    center_shift = (n_magnets * length + (n_magnets - 1) * gap) / 2
+    x = np.linspace(-1*xbrim - center_shift, n_magnets * (length + gap) + xbrim - center_shift, int((xbrim + center_shift)*resolution))
+    y = np.linspace(-1*yrange/2, yrange/2, int(yrange*resolution))
+    X, Y = np.meshgrid(x, y)
+
+    sources = _sources(design, magnets, model)
+    cache = FieldCache()
+    # The direct solver's grid is the one the step scripts cache
+    kind = 'ring_field' if model == 'axisymmetric' else 'pm_field' if solver == 'direct' else f'pm_field {solver}'
+    key = cache.key(kind=kind, sources=sources, x=(x[0], x[-1], len(x)), y=(y[0], y[-1], len(y)))
+    Bx, By = cache.arrays(key, ('Bx', 'By'), lambda: _field(sources, model, solver)(X, Y))
+    np.savez(output, x=x, y=y, Bx=Bx, By=By)
+    print(f"Field on {len(y)} x {len(x)} points written to {output}")
+
+def compute_forces(params, output, positions=None, model='planar', solver='direct'):
+    """Force per ampere of each phase and the thrust metrics over `positions`."""
+    from carriage import force_basis, thrust_metrics
+
+    design, magnets, winding = compute_design(params)
+    field = _field(_sources(design, magnets, model), model, solver)
+    positions = _positions(design, positions)
+    period = 2 * (design['length'] + design['gap'])
+    Gx, Gy = force_basis(field, positions, winding)
+    metrics = thrust_metrics(field, positions, period, winding=winding, basis=(Gx, Gy))
+    np.savez(output, positions=positions, Gx=Gx, Gy=Gy, **metrics)
+    print(f"Force constant {metrics['force_constant']:.4g} per A, commutation angle {metrics['commutation_angle']:.4g} rad, "
+          f"thrust ripple {metrics['thrust_ripple']:.2%}; written to {output}")
+
+def compute_emf(params, output, positions=None, velocity=1.0, model='planar', solver='direct'):
+    """Back-EMF of every phase at a constant carriage velocity over `positions`."""
+    from carriage import back_emf
+
+    design, magnets, winding = compute_design(params)
+    field = _field(_sources(design, magnets, model), model, solver)
+    positions = _positions(design, positions)
+    emf = back_emf(field, positions, velocity, winding)
+    np.savez(output, positions=positions, velocity=velocity, emf=emf)
+    print(f"Peak back-EMF {np.max(np.abs(emf)):.4g} at velocity {velocity:g}; written to {output}")
+
+def compute_tolerance(params, output, n_samples, strength_tolerance, position_tolerance, inset_tolerance,
+                      distribution='normal', seed=None):
+    """Monte-Carlo distribution of the thrust and EMF metrics under magnet tolerances."""
+    from tolerance import tolerance_analysis, print_summary, metric_names
+
+    design = {**compute_defaults, **params}
+    result = tolerance_analysis(design, n_samples, strength_tolerance, position_tolerance, inset_tolerance, distribution, seed=seed)
+    print_summary(result)
+    np.savez(output, levels=result['levels'], **result['samples'],
+             **{f'{name}_nominal': result['nominal'][name] for name in metric_names},
+             **{f'{name}_percentiles': result['percentiles'][name] for name in metric_names})
+    print(f"{n_samples} samples written to {output}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the step scripts headless and compute fields, forces and back-EMF.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='run a step script with the Agg backend')
+    run.add_argument('step', type=int, help='step number (1-6)')
+    run.add_argument('-o', '--output', help='output file (GIF, APNG, MP4 or, for figures, any image format matplotlib writes)')
+    run.add_argument('--dpi', type=int, help='resolution of the figure or frames')
+    run.add_argument('--frames', type=int, help='number of animation frames')
+    run.add_argument('--workers', type=int, help='render processes (default: every core)')
+    run.add_argument('--store', help='keep finished frames in this directory and resume from it')
+    run.add_argument('--range', type=int, nargs=2, metavar=('START', 'STOP'), help='only render these frames into --store')
+
+    fields = commands.add_parser('fields', help='magnet field on the grid of the step scripts')
+    fields.add_argument('--resolution', type=float, default=40, help='grid points per unit length (default 40)')
+    forces = commands.add_parser('forces', help='force per ampere of each phase and the thrust metrics')
+    emf = commands.add_parser('emf', help='back-EMF of each phase')
+    emf.add_argument('--velocity', type=float, default=1.0, help='carriage velocity (default 1)')
+    tolerance = commands.add_parser('tolerance', help='Monte-Carlo spread of the thrust and EMF metrics under magnet tolerances')
+    tolerance.add_argument('--samples', type=int, default=1000, help='number of perturbed magnet arrays (default 1000)')
+    tolerance.add_argument('--strength-tolerance', type=float, default=0.02, help='relative remanence tolerance (default 0.02)')
+    tolerance.add_argument('--position-tolerance', type=float, default=0.01, help='magnet position tolerance (default 0.01)')
+    tolerance.add_argument('--inset-tolerance', type=float, default=0.01, help='pole inset tolerance (default 0.01)')
+    tolerance.add_argument('--distribution', choices=('normal', 'uniform'), default='normal',
+                           help='normal with the tolerances as 3 sigma, or uniform within them (default normal)')
+    tolerance.add_argument('--seed', type=int, help='random seed')
+    for command, default in ((fields, 'fields.npz'), (forces, 'forces.npz'), (emf, 'emf.npz'), (tolerance, 'tolerance.npz')):
+        command.add_argument('-o', '--output', default=default, help=f'.npz file to write (default {default})')
+    for command in (fields, forces, emf):
+        command.add_argument('--model', choices=('planar', 'axisymmetric'), default='planar', help='field model (default planar)')
+        command.add_argument('--solver', choices=('direct', 'periodic', 'tree'), default='direct',
+                             help='planar field solver: direct summation, closed-form periodic cells for long arrays '
+                                  'or a Barnes-Hut tree for many sources (default direct)')
+    for command in (forces, emf):
+        command.add_argument('--positions', type=float, nargs=3, metavar=('START', 'STOP', 'COUNT'),
+                             help='carriage positions (default: one magnetic period around the centre)')
+
+    for command in (run, fields, forces, emf, tolerance):
+        command.add_argument('-p', '--params', help='JSON file of parameter values')
+        command.add_argument('--set', action='append', default=[], metavar='NAME=VALUE', help='set one parameter (repeatable)')
+        command.add_argument('--backend', help="field backend: 'numpy', 'numexpr', 'numba' or 'auto'")
+    args = parser.parse_args(argv)
+
+    try:
+        params = load_parameters(args.params, args.set)
+        if args.backend:
+            from field_backends import set_backend
+            set_backend(args.backend)
+        if args.command == 'run':
+            for name, value in (('output_path', args.output), ('dpi', args.dpi), ('num_frames', args.frames), ('workers', args.workers),
+                                ('frame_store', args.store), ('frame_range', args.range)):
+                if value is not None:
+                    params[name] = value
+            unknown = set(params) - script_parameters(step_script(args.step))
+            if args.store is not None:
+                check_store(args.store, params.get('num_frames'), args.range)
+        else:
+            unknown = set(params) - set(compute_defaults)
+        if unknown:
+            raise ValueError(f"unknown parameters for {args.command}: {', '.join(sorted(unknown))}")
+        if getattr(args, 'solver', 'direct') != 'direct' and args.model != 'planar':
+            raise ValueError(f"the {args.solver} solver only applies to the planar model")
+        if args.command == 'tolerance' and not params.get('reverse_every_other', True):
+            raise ValueError("the tolerance analysis needs alternating magnets (reverse_every_other)")
+    except (ValueError, OSError) as error:
+        parser.error(str(error))
+
+    if args.command == 'run':
+        from frame_store import StoreMismatch
+        try:
+            run_step(args.step, params)
+        except StoreMismatch as error:
+            # Raised when the script opens the store, before it renders anything
+            parser.error(str(error))
+    elif args.command == 'fields':
+        compute_fields(params, args.output, args.resolution, args.model, args.solver)
+    elif args.command == 'forces':
+        compute_forces(params, args.output, args.positions, args.model, args.solver)
+    elif args.command == 'emf':
+        compute_emf(params, args.output, args.positions, args.velocity, args.model, args.solver)
+    else:
+        compute_tolerance(params, args.output, args.samples, args.strength_tolerance, args.position_tolerance,
+                          args.inset_tolerance, args.distribution, args.seed)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import functools
+import numpy as np
+from magnet_field import magnet_array, magnet_sources, batched_array_field, default_chunk_size
+from carriage import make_winding, force_basis, thrust_metrics, emf_harmonics
+from sweep import default_design
+
+# Monte-Carlo tolerance analysis of the magnet array.
+#
+# Every sample is the design's magnet array with each magnet's remanence
+# (strength), position along the array (start_x) and pole insets drawn
+# independently around their nominal values. All samples of a chunk are
+# evaluated at once: batched_array_field gives the field of every sample at
+# every wire position with the samples along the leading axis, force_basis
+# and thrust_metrics carry that axis through, so a few thousand perturbed
+# arrays cost a handful of array operations instead of a few thousand runs.
+#
+# Tolerances are given as limits: with distribution='normal' a limit is
+# read as 3 sigma, with 'uniform' as the half width.
+
+metric_names = ('force_constant', 'commutation_angle', 'thrust_ripple',
+                'emf_constant', 'emf_thd', 'emf_h3', 'emf_h5', 'emf_unbalance')
+
+def _deviations(rng, distribution, tolerance, shape):
+    if distribution == 'normal':
+        return tolerance / 3 * rng.standard_normal(shape)
+    if distribution == 'uniform':
+        return rng.uniform(-tolerance, tolerance, shape)
+    raise ValueError(f"unknown distribution {distribution!r}; use 'normal' or 'uniform'")
+
+def perturbed_sources(magnets, strength, n_samples, strength_tolerance=0.0, position_tolerance=0.0,
+                      inset_tolerance=0.0, distribution='normal', rng=None):
+    """Sources of `n_samples` perturbed copies of `magnets`, shape (n_samples, 2 * n_magnets, 3).
+
+    `strength_tolerance` is relative (0.02 for +-2 % remanence), the
+    position and inset tolerances are lengths. A magnet's strength and
+    position deviation apply to both of its poles; each pole's inset
+    deviates on its own, moving the pole further into the magnet when
+    positive.
+    """
+    rng = np.random.default_rng(rng)
+    nominal = magnet_sources(magnets, strength)
+    n_magnets = len(magnets)
+    centres = np.repeat([start_x + width / 2 for start_x, _, width, *_ in magnets], 2)
+    inward = np.sign(centres - nominal[:, 0])
+
+    sources = np.broadcast_to(nominal, (n_samples,) + nominal.shape).copy()
+    sources[:, :, 2] *= np.repeat(1 + _deviations(rng, distribution, strength_tolerance, (n_samples, n_magnets)), 2, axis=1)
+    sources[:, :, 0] += np.repeat(_deviations(rng, distribution, position_tolerance, (n_samples, n_magnets)), 2, axis=1)
+    sources[:, :, 0] += inward * _deviations(rng, distribution, inset_tolerance, (n_samples, 2 * n_magnets))
+    return sources
+
+def sample_metrics(sources, positions, period, n_periods, winding, chunk_size=default_chunk_size):
+    """Thrust and back-EMF metrics of every sample of `sources`, each of shape (n_samples,).
+
+    Each sample is commutated at its own best angle, as a drive calibrated
+    on the assembled motor would be. The EMF metrics are those of
+    carriage.emf_harmonics at unit velocity, taking the worst phase for the
+    distortion and the mean over the phases for 'emf_constant';
+    'emf_unbalance' is the spread of the three fundamentals relative to
+    their mean.
+    """
+    field = functools.partial(batched_array_field, sources=sources, chunk_size=chunk_size)
+    basis = force_basis(field, positions, winding)
+    thrust = thrust_metrics(None, positions, period, basis=basis)
+    # The back-EMF at unit velocity is the force per ampere along the motion
+    emf = emf_harmonics(basis[0], n_periods)
+    fundamentals = emf['emf_constant']
+    return {
+        'force_constant': thrust['force_constant'],
+        'commutation_angle': thrust['commutation_angle'],
+        'thrust_ripple': thrust['thrust_ripple'],
+        'emf_constant': fundamentals.mean(axis=-1),
+        'emf_thd': emf['emf_thd'].max(axis=-1),
+        'emf_h3': emf['emf_h3'].max(axis=-1),
+        'emf_h5': emf['emf_h5'].max(axis=-1),
+        'emf_unbalance': np.ptp(fundamentals, axis=-1) / fundamentals.mean(axis=-1),
+    }
+
+def tolerance_analysis(design=None, n_samples=1000, strength_tolerance=0.02, position_tolerance=0.01,
+                       inset_tolerance=0.01, distribution='normal', n_periods=1, points_per_period=128,
+                       samples_per_chunk=256, seed=None, percentiles=(1, 5, 50, 95, 99)):
+    """Distribution of the thrust and back-EMF metrics of a design under magnet tolerances.
+
+    `design` overrides entries of sweep.default_design. The carriage is
+    swept over `n_periods` magnetic periods around the array centre.
+    Samples are evaluated `samples_per_chunk` at a time, which bounds the
+    memory to that many copies of the wire field. Returns a dict with the
+    metrics of the nominal design ('nominal'), every sample ('samples'),
+    and the `percentiles` of each metric ('percentiles', one row per
+    metric in the order of 'levels').
+    """
+    design = {**default_design, **(design or {})}
+    magnets = magnet_array(int(design['n_magnets']), design['length'], design['gap'], design['height'], design['dipole_inset'])
+    winding = make_winding(design['coil_pitch'], design['coil_y'])
+    period = 2 * (design['length'] + design['gap'])
+    positions = np.linspace(-n_periods * period / 2, n_periods * period / 2, n_periods * points_per_period, endpoint=False)
+
+    nominal = sample_metrics(magnet_sources(magnets, design['strength'])[None], positions, period, n_periods, winding)
+    # Drawn up front (they are small), so the samples do not depend on the chunk size
+    sources = perturbed_sources(magnets, design['strength'], n_samples, strength_tolerance, position_tolerance,
+                                inset_tolerance, distribution, seed)
+    samples = {name: np.empty(n_samples) for name in metric_names}
+    for lo in range(0, n_samples, samples_per_chunk):
+        chunk = sample_metrics(sources[lo:lo + samples_per_chunk], positions, period, n_periods, winding)
+        for name, values in chunk.items():
+            samples[name][lo:lo + samples_per_chunk] = values
+
+    return {
+        'nominal': {name: float(values[0]) for name, values in nominal.items()},
+        'samples': samples,
+        'levels': np.array(percentiles),
+        'percentiles': {name: np.percentile(values, percentiles) for name, values in samples.items()},
+    }
+
+def print_summary(result):
+    """Print the nominal value and the percentiles of every metric."""
+    levels = result['levels']
+    print(f"{'metric':18s} {'nominal':>10s} " + ' '.join(f"{f'P{level:g}':>10s}" for level in levels))
+    for name in metric_names:
+        print(f"{name:18s} {result['nominal'][name]:10.4g} " + ' '.join(f"{value:10.4g}" for value in result['percentiles'][name]))
@@ -0,0 +1,112 @@
+import numpy as np
+
+# Barnes-Hut tree code for the field of very many monopoles.
+#
+# In complex form a monopole contributes Bx - i By = q / (z - z_s). Far from a
+# cluster of sources centred on c that sum is the multipole expansion
+#
+#     sum_s q_s / (z - z_s) = sum_k a_k / (z - c)**(k + 1),   a_k = sum_s q_s (z_s - c)**k,
+#
+# truncated after `order` terms. Sources are organised in a quadtree; each
+# cell is evaluated with its expansion for all targets that are well
+# separated from it and opened up for the rest, down to leaves that are
+# summed directly. Targets are processed together per cell, so a traversal
+# visits every cell at most once.
+
+def expansion_order(tol, theta):
+    """Number of multipole terms needed for a relative error of about `tol` at opening angle `theta`."""
+    return max(1, int(np.ceil(np.log(tol * (1 - theta)) / np.log(theta))))
+
+class _Cell:
+    __slots__ = ('center', 'radius', 'lo', 'hi', 'coefficients', 'children')
+
+class SourceTree:
+    """Quadtree over packed (x, y, q) sources for approximate field evaluation.
+
+    `tol` is the relative accuracy of each far-field cell contribution,
+    `theta` the opening angle (cells are expanded when their radius is
+    below theta times their distance to the target) and `leaf_size` the
+    largest number of sources summed directly in one leaf.
+    """
+
+    def __init__(self, sources, tol=1e-6, theta=0.5, leaf_size=32):
+        sources = np.asarray(sources, dtype=float).reshape(-1, 3)
+        self.theta = theta
+        self.leaf_size = leaf_size
+        self.order = expansion_order(tol, theta)
+
+        # Sources are copied in tree order so that every cell owns a contiguous slice
+        self._source_z = sources[:, 0] + 1j * sources[:, 1]
+        self._source_q = sources[:, 2]
+        self.z = np.empty_like(self._source_z)
+        self.q = np.empty_like(self._source_q)
+        self.root = self._build(np.arange(len(sources)), 0, 0) if len(sources) else None
+
+    def _build(self, index, lo, depth):
+        z = self._source_z[index]
+        q = self._source_q[index]
+        self.z[lo:lo + len(index)] = z
+        self.q[lo:lo + len(index)] = q
+
+        cell = _Cell()
+        cell.lo, cell.hi = lo, lo + len(index)
+        cell.center = complex((z.real.min() + z.real.max()) / 2, (z.imag.min() + z.imag.max()) / 2)
+        offsets = z - cell.center
+        cell.radius = np.abs(offsets).max()
+        cell.coefficients = np.vander(offsets, self.order + 1, increasing=True).T @ q
+        cell.children = []
+
+        if len(index) > self.leaf_size and cell.radius > 0 and depth < 64:
+            quadrant = (offsets.real > 0) + 2 * (offsets.imag > 0)
+            order = np.argsort(quadrant, kind='stable')
+            index, quadrant = index[order], quadrant[order]
+            bounds = np.searchsorted(quadrant, np.arange(5))
+            for i in range(4):
+                if bounds[i + 1] > bounds[i]:
+                    cell.children.append(self._build(index[bounds[i]:bounds[i + 1]], lo + bounds[i], depth + 1))
+        return cell
+
+    def _direct(self, cell, zt, chunk=2**16):
+        zs = self.z[cell.lo:cell.hi]
+        q = self.q[cell.lo:cell.hi]
+        B = np.empty(zt.shape, dtype=complex)
+        for lo in range(0, len(zt), chunk):
+            dz = zt[lo:lo + chunk, None] - zs
+            r_squared = dz.real**2 + dz.imag**2
+            r_squared[r_squared == 0] = 1e-12
+            # q / (z - z_s) = q conj(z - z_s) / |z - z_s|^2
+            B[lo:lo + chunk] = (np.conj(dz) / r_squared) @ q
+        return B
+
+    def _evaluate(self, cell, zt, index, B):
+        distance = np.abs(zt - cell.center)
+        far = cell.radius < self.theta * distance
+        if far.any():
+            u = 1 / (zt[far] - cell.center)
+            series = np.full(u.shape, cell.coefficients[-1])
+            for a in cell.coefficients[-2::-1]:
+                series = series * u + a
+            B[index[far]] += series * u
+
+        near = ~far
+        if not near.any():
+            return
+        zt, index = zt[near], index[near]
+        if not cell.children:
+            B[index] += self._direct(cell, zt)
+            return
+        for child in cell.children:
+            self._evaluate(child, zt, index, B)
+
+    def field(self, x, y):
+        """Approximate superposed field at the points (x, y), like magnet_field.array_field."""
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        zt = (x + 1j * y).ravel()
+        B = np.zeros(zt.shape, dtype=complex)
+        if self.root is not None:
+            self._evaluate(self.root, zt, np.arange(len(zt)), B)
+        return B.real.reshape(x.shape), -B.imag.reshape(y.shape)
+
+def tree_field(x, y, sources, tol=1e-6, theta=0.5, leaf_size=32):
+    """Field of `sources` at (x, y) using a Barnes-Hut tree; see SourceTree."""
+    return SourceTree(sources, tol, theta, leaf_size).field(x, y)
@@ -0,0 +1,74 @@
+import numpy as np
+from magnet_field import current_carrying_wire_field
+from carriage import phase_shifts, step5_winding, winding_arrays
+
+class WindingFieldBasis:
+    """Total field of the magnet array plus the energised carriage winding on a fixed grid.
+
+    The winding moves rigidly with the carriage and its field is linear in
+    the phase currents, so the field of one ampere in each phase is computed
+    once, on a carriage-relative grid with the same spacing as `x` that is
+    wide enough for every carriage position in `travel`. Each frame is then
+
+        B = B_pm + sum_k I_k B_k(x - position),
+
+    a few in-place multiply-adds over the grid. The basis is only shifted
+    by whole grid columns: the winding is placed at the grid position
+    nearest to `position` (see grid_position), at most half a column away,
+    and its field there is exact. Interpolating between columns instead
+    smears the 1/r field in the grid cells around each wire, where it was
+    off by more than its own magnitude.
+    """
+
+    def __init__(self, x, y, Bx_pm, By_pm, travel, winding=step5_winding):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.x0 = x[0]
+        self.dx = (x[-1] - x[0]) / (len(x) - 1)
+        self.nx = len(x)
+        self.Bx_pm = Bx_pm
+        self.By_pm = By_pm
+
+        # Carriage-relative columns u = x - position for every position in travel, plus one for rounding
+        self.u0 = x[0] - travel[1]
+        n_u = int(np.ceil((x[-1] - travel[0] - self.u0) / self.dx)) + 2
+        U, Y = np.meshgrid(self.u0 + self.dx * np.arange(n_u), y)
+
+        offsets, ys, phases, signs = winding_arrays(winding)
+        self.Bx_basis = np.zeros((len(phase_shifts),) + U.shape)
+        self.By_basis = np.zeros((len(phase_shifts),) + U.shape)
+        for offset, wire_y, phase, sign in zip(offsets, ys, phases, signs):
+            Bx, By = current_carrying_wire_field(U, Y, offset, wire_y, sign)
+            self.Bx_basis[phase] += Bx
+            self.By_basis[phase] += By
+
+        self._scratch = np.empty(np.shape(Bx_pm))
+
+    def _column(self, position):
+        # Basis column that lines up with the first grid column for the carriage at `position`
+        i = int(np.rint((self.x0 - position - self.u0) / self.dx))
+        if i < 0 or i + self.nx > self.Bx_basis.shape[2]:
+            raise ValueError(f"carriage position {position} is outside the travel the basis was built for")
+        return i
+
+    def grid_position(self, position):
+        """The carriage position, within half a grid column of `position`, that field() uses."""
+        return self.x0 - self.u0 - self._column(position) * self.dx
+
+    def field(self, position, currents, out=None):
+        """Total (Bx, By) on the grid for the carriage at grid_position(position) with phase `currents`.
+
+        `out` may be a pair of preallocated arrays shaped like the PM field,
+        in which case no memory is allocated per frame.
+        """
+        if out is None:
+            out = (np.empty(np.shape(self.Bx_pm)), np.empty(np.shape(self.By_pm)))
+        i = self._column(position)
+
+        scratch = self._scratch
+        for Bout, B_pm, basis in zip(out, (self.Bx_pm, self.By_pm), (self.Bx_basis, self.By_basis)):
+            np.copyto(Bout, B_pm)
+            for B_k, current in zip(basis, currents):
+                np.multiply(B_k[:, i:i + self.nx], current, out=scratch)
+                Bout += scratch
+        return out